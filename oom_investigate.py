@@ -13,15 +13,34 @@ import datetime
 import errno
 import fnmatch
 import gzip
+import hashlib
+import heapq
+import io
 import itertools
+import json
 import os
 import re
+import socket
 import subprocess
 import sys
+import tarfile
+import threading
+import time
 import warnings
-from collections import defaultdict
+import zlib
+from collections import defaultdict, deque
 from optparse import OptionParser
 
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+try:
+    import sqlite3
+except ImportError:  # Some minimal Python builds ship without the sqlite3 module
+    sqlite3 = None
+
 warnings.filterwarnings(
     "ignore", category=DeprecationWarning
 )  # Hide platform.dist() related deprecation warnings
@@ -47,6 +66,92 @@ def std_exceptions(etype, value, tb):
 sys.excepthook = std_exceptions
 
 
+# Lines worth decoding outside of an OOM block. Matched against raw bytes so the rest of the
+# log (usually well over 99% of it) is never decoded.
+OOM_MARKERS = re.compile(
+    # Not a raw string: Python 2.7 has no rb"" prefix
+    b"invoked oom-killer|\\[\\s*pid\\s*\\]|[Kk]illed process|pages RAM|memory: usage"
+)
+OOM_START = re.compile(b"\\[\\s*pid\\s*\\]")
+# The printk caller id after a dmesg timestamp: "[  123.456789][ T1234]"
+PRINTK_CALLER = re.compile(b"\\d\\]\\[\\s*([TC]\\d+)\\]")
+# The hostname field of a syslog or journalctl (short-iso) line
+HOSTNAME = re.compile(
+    b"(?:\\w{3}\\s+\\d{1,2}\\s+\\d{2}:\\d{2}:\\d{2}|\\d{4}-\\d{2}-\\d{2}T\\S+)\\s+(\\S+)\\s"
+)
+
+# System wide Mem-Info counters, logged in pages. Values followed by "kB" are per node.
+MEMINFO_COUNTERS = re.compile(
+    r"\b(active_anon|inactive_anon|active_file|inactive_file|unevictable|shmem|"
+    r"slab_reclaimable|slab_unreclaimable|pagetables|free|mapped):(\d+)\b(?!kB)"
+)
+MEMINFO_TOTALS = [
+    ("pagecache", re.compile(r"(\d+) total pagecache pages")),
+    ("ram", re.compile(r"(\d+) pages RAM")),
+    ("swap_free", re.compile(r"Free swap\s*=\s*(\d+)kB")),
+    ("swap_total", re.compile(r"Total swap\s*=\s*(\d+)kB")),
+]
+
+# The allocation that failed, from the invoking line: "gfp_mask=0x280da, order=0" or, since
+# Linux 4.4ish, "gfp_mask=0x6200ca(GFP_HIGHUSER_MOVABLE), order=0"
+ALLOCATION = re.compile(r"gfp_mask=(0x[0-9a-fA-F]+)(?:\(([^)]*)\))?,\s*order=(-?\d+)")
+# A zone's buddy free lists: "Node 0 Normal: 635*4kB (UME) 480*8kB (UME) ... = 37900kB"
+BUDDY_ZONE = re.compile(r"(Node \d+ \w+): ((?:\d+\*\d+kB (?:\(\w+\) )?)+)= \d+kB")
+BUDDY_BLOCKS = re.compile(r"(\d+)\*(\d+)kB")
+# A zone's free memory and watermarks: "Node 0 DMA32 free:43760kB min:31812kB low:39764kB
+# high:47716kB ...", with "boost:0kB" after free since Linux 5.0
+ZONE_WATERMARKS = re.compile(r"\b(Node \d+ \w+) free:\d+kB ")
+WATERMARKS = re.compile(r"\b(free|min|low|high):(\d+)kB")
+# The task's cpuset line before the Mem-Info dump, on kernels that log it on its own
+CPUSET = re.compile(r"cpuset=(\S+) mems_allowed=([\d,-]+)")
+# Bits of the pre-4.4 gfp_mask layout, which was logged without the flag names
+LEGACY_GFP_FLAGS = [
+    (0x01, "__GFP_DMA"),
+    (0x02, "__GFP_HIGHMEM"),
+    (0x04, "__GFP_DMA32"),
+    (0x08, "__GFP_MOVABLE"),
+    (0x10, "__GFP_WAIT"),
+    (0x20, "__GFP_HIGH"),
+    (0x40, "__GFP_IO"),
+    (0x80, "__GFP_FS"),
+    (0x100, "__GFP_COLD"),
+    (0x200, "__GFP_NOWARN"),
+    (0x400, "__GFP_REPEAT"),
+    (0x800, "__GFP_NOFAIL"),
+    (0x1000, "__GFP_NORETRY"),
+    (0x4000, "__GFP_COMP"),
+    (0x8000, "__GFP_ZERO"),
+    (0x10000, "__GFP_NOMEMALLOC"),
+    (0x20000, "__GFP_HARDWALL"),
+    (0x40000, "__GFP_THISNODE"),
+    (0x80000, "__GFP_RECLAIMABLE"),
+]
+
+ARCHIVE_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.xz", ".txz", ".tar.bz2", ".tbz2")
+# Logs read from inside an archive: (directory, file name) patterns. Rotations of each are
+# matched the same way System.search_log_dir() finds them on disk.
+ARCHIVE_LOGS = (
+    ("var/log", "messages"),
+    ("var/log", "syslog"),
+    ("var/log", "kern.log"),
+    # sosreport's captured journal and dmesg output
+    ("sos_commands/logs", "journalctl_--no-pager*"),
+    ("sos_commands/kernel", "dmesg"),
+)
+
+# Line prefixes used to order lines from several sources by time: syslog, journalctl's
+# short-iso output and dmesg's seconds since boot
+SYSLOG_TIME = re.compile(b"([A-Z][a-z]{2}) +(\\d+) (\\d\\d:\\d\\d:\\d\\d)")
+ISO_TIME = re.compile(b"\\d{4}-(\\d\\d)-(\\d\\d)[T ](\\d\\d:\\d\\d:\\d\\d)")
+UPTIME_STAMP = re.compile(b"\\[\\s*(\\d+)\\.\\d+\\]\\s*")
+MONTHS = dict(
+    (month.encode("ascii"), number)
+    for number, month in enumerate(
+        "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(), 1
+    )
+)
+
+
 # Helper functions # {{{
 def open_file(file_path):
     """Handle reading of gzipped and regular files"""
@@ -56,6 +161,388 @@ def open_file(file_path):
         return open(file_path, "r")
 
 
+def open_binary(file_path):
+    """Handle reading of gzipped and regular files as bytes"""
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+def is_archive(file_path):
+    """Check if a file is a tar archive (e.g. a sosreport) rather than a log file"""
+    return file_path.endswith(ARCHIVE_EXTENSIONS)
+
+
+def iter_lines(chunks):
+    """Split an iterable of byte chunks into lines, keeping line endings like a file does"""
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if pending:
+        yield pending
+
+
+def iter_chunks(fileobj, size=1024 * 1024):
+    while True:
+        chunk = fileobj.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_reversed_lines(fileobj, size=1024 * 1024):
+    """
+    Yield (offset, raw line) from the end of a seekable binary file back to its start,
+    reading it backwards `size` bytes at a time
+    """
+    fileobj.seek(0, os.SEEK_END)
+    end = fileobj.tell()
+    # The end of a line whose start is in an earlier block
+    pending = b""
+    while end > 0:
+        start = max(0, end - size)
+        fileobj.seek(start)
+        data = fileobj.read(end - start) + pending
+        stop = len(data)
+        while stop > 0:
+            newline = data.rfind(b"\n", 0, stop - 1)
+            if newline == -1 and start > 0:
+                break
+            yield start + newline + 1, data[newline + 1 : stop]
+            stop = newline + 1
+        pending = data[:stop]
+        end = start
+
+
+def iter_dropping_cache(fileobj, size=1024 * 1024):
+    """
+    Like iter_chunks(), but pages already read are dropped from the page cache as it goes, so
+    reading a large log doesn't evict the cache of whatever else runs on the box. Needs
+    os.posix_fadvise (Python 3.3+); without it this is just iter_chunks().
+    """
+    fadvise = getattr(os, "posix_fadvise", None)
+    done = 0
+    for chunk in iter_chunks(fileobj, size):
+        yield chunk
+        done += len(chunk)
+        if fadvise is not None:
+            try:
+                fadvise(fileobj.fileno(), 0, done, os.POSIX_FADV_DONTNEED)
+            except OSError:
+                fadvise = None
+
+
+def lower_priority():
+    """Run at the lowest CPU priority and the idle I/O class, where the OS allows it"""
+    try:
+        os.nice(19)
+    except (AttributeError, OSError):
+        pass
+    try:
+        with open(os.devnull, "w") as devnull:
+            subprocess.call(
+                ["ionice", "-c", "3", "-p", str(os.getpid())],
+                stdout=devnull,
+                stderr=devnull,
+            )
+    except OSError:
+        # No ionice (e.g. OSX)
+        pass
+
+
+def iter_gunzip(chunks):
+    """
+    Decompress gzip data from a stream of chunks. Unlike gzip.GzipFile this never seeks, so it
+    works on archive members read straight out of a compressed tarball.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            # Concatenated gzip members (e.g. from logrotate's delaycompress) start again
+            chunk = decompressor.unused_data
+            if chunk:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    yield decompressor.flush()
+
+
+def decode_line(raw):
+    """
+    Decode a raw log line, never failing on bytes that aren't valid UTF-8. Python 2 gets it
+    back as a UTF-8 encoded str, so it formats into the (byte string) report like before.
+    """
+    line = raw.decode("utf-8", "replace").strip()
+    if not isinstance(line, str):
+        line = line.encode("utf-8")
+    return line
+
+
+def encode_text(text):
+    """The UTF-8 bytes of a decoded line's text, on either Python version"""
+    return text if isinstance(text, bytes) else text.encode("utf-8")
+
+
+def boot_time():
+    """When this machine booted, used to place dmesg's seconds since boot in time"""
+    try:
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return datetime.datetime.now() - datetime.timedelta(seconds=uptime)
+
+
+def line_time_key(raw, booted=None):
+    """
+    Sortable (month, day, time) of a raw syslog, journalctl or dmesg line, or None. There is
+    no year or timezone: syslog logs neither, and journalctl already prints local time.
+    """
+    match = SYSLOG_TIME.match(raw)
+    if match:
+        return MONTHS.get(match.group(1), 0), int(match.group(2)), match.group(3)
+    match = ISO_TIME.match(raw)
+    if match:
+        return int(match.group(1)), int(match.group(2)), match.group(3)
+    match = UPTIME_STAMP.match(raw)
+    if match and booted is not None:
+        time = booted + datetime.timedelta(seconds=int(match.group(1)))
+        return time.month, time.day, time.strftime("%H:%M:%S").encode("ascii")
+    return None
+
+
+def line_body(raw):
+    """A kernel line without its source specific prefixes, to spot the same line elsewhere"""
+    index = raw.find(b"kernel: ")
+    if index != -1:
+        raw = raw[index + 8 :]
+    return UPTIME_STAMP.sub(b"", raw, 1).strip()
+
+
+def read_ahead(lines, out, batch_size=1000):
+    """Thread target: read `lines` into the `out` queue in batches, then None (or the error)"""
+    batch = []
+    try:
+        for line in lines:
+            batch.append(line)
+            if len(batch) == batch_size:
+                out.put(batch)
+                batch = []
+        out.put(batch)
+        out.put(None)
+    except Exception as error:  # pylint: disable=broad-except
+        out.put(error)
+
+
+def iter_queue(batches):
+    """Lines from a read_ahead() queue, raising any error the reader hit"""
+    while True:
+        batch = batches.get()
+        if batch is None:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        for line in batch:
+            yield line
+
+
+def merge_by_time(streams, booted=None, years=None):
+    """
+    Merge several streams of raw lines into one ordered by timestamp, yielding
+    (stream index, line). Only one line per stream is held at a time. Each stream keeps its
+    own order; lines without a timestamp sort with the line before them.
+
+    `years` optionally gives the (year, month) of each stream's first line, so streams that
+    cross a new year are still ordered correctly.
+    """
+    heap = []
+    last_keys = [()] * len(streams)
+
+    def push(index):
+        for raw in streams[index]:
+            key = line_time_key(raw, booted)
+            if key and years:
+                year, month = years[index]
+                key = (year + (key[0] < month),) + key
+            last_keys[index] = key or last_keys[index]
+            heapq.heappush(heap, (last_keys[index], index, raw))
+            return
+
+    for index in range(len(streams)):
+        push(index)
+    while heap:
+        _, index, raw = heapq.heappop(heap)
+        yield index, raw
+        push(index)
+
+
+def current_rss_mb():
+    """Resident memory of this process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024.0**2)
+    except (IOError, OSError, ValueError, IndexError):
+        # Not Linux, fall back to the peak RSS which is KB on Linux and bytes on OSX
+        import resource  # pylint: disable=import-outside-toplevel
+
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            max_rss /= 1024.0
+        return max_rss / 1024.0
+
+
+def with_year(timestamp, reference_time):
+    """Naive timestamp with the year filled in for syslog times, which don't log one"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.replace(tzinfo=None)
+    if timestamp.year == 1900:
+        timestamp = timestamp.replace(year=reference_time.year)
+        # A timestamp "after" the reference time must be from the previous year
+        if timestamp > reference_time:
+            timestamp = timestamp.replace(year=timestamp.year - 1)
+    return timestamp
+
+
+class TopK(object):
+    """
+    Bounded per-name totals (a space-saving sketch)
+
+    At most `size` names are tracked. When the table is full, a new name replaces the one with
+    the smallest total and inherits that total, so the heaviest names are always kept and
+    their totals are never under-estimated. The smallest is found with a min-heap of
+    (total, name) entries, where entries whose total has since grown are skipped, so an
+    eviction never scans the whole table.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.totals = {}
+        self.heap = []
+
+    def add(self, name, value):
+        entry = self.totals.get(name)
+        if entry is None:
+            floor = 0
+            if len(self.totals) >= self.size:
+                smallest, floor = self.pop_smallest()
+                del self.totals[smallest]
+            entry = self.totals[name] = [floor, 0]
+        entry[0] += value
+        entry[1] += 1
+        heapq.heappush(self.heap, (entry[0], name))
+        # Drop the stale entries once they outnumber the live ones
+        if len(self.heap) > 2 * self.size + 16:
+            self.heap = [(total, key) for key, (total, _) in self.totals.items()]
+            heapq.heapify(self.heap)
+
+    def pop_smallest(self):
+        """The tracked name with the smallest total, and that total"""
+        while True:
+            total, name = heapq.heappop(self.heap)
+            entry = self.totals.get(name)
+            if entry is not None and entry[0] == total:
+                return name, total
+
+    def as_processes(self):
+        """Totals in the same shape as parsed process rows"""
+        return [
+            {"pid": None, "name": name, "rss": total, "count": count}
+            for name, (total, count) in self.totals.items()
+        ]
+
+
+class ServiceGroups(object):
+    """
+    Maps process names to the service they belong to (e.g. php-fpm7.4 -> php), using rules
+    read from a file, one per line:
+
+        # kind   pattern        service
+        glob     php-fpm*       php
+        prefix   python         python-workers
+        regex    java(-\\d+)?   billing-jvm
+
+    Globs and regexes must match the whole name, prefixes its start. The first matching rule
+    wins and names that match no rule are left as they are. All rules are compiled into a
+    single alternation, and each name's result is cached, so a name seen in thousands of
+    process rows is only matched once.
+    """
+
+    KINDS = ("glob", "prefix", "regex")
+    # Python 2's re module allows at most 100 named groups per pattern
+    RULES_PER_PATTERN = 90
+    CACHE_SIZE = 100000
+
+    def __init__(self, rules):
+        self.services = [service for _, _, service in rules]
+        parts = []
+        for index, (kind, pattern, _) in enumerate(rules):
+            if kind == "glob":
+                pattern = self.glob_to_regex(pattern) + "$"
+            elif kind == "prefix":
+                pattern = re.escape(pattern)
+            else:
+                pattern = "(?:" + pattern + ")$"
+            parts.append("(?P<r{}>{})".format(index, pattern))
+        self.patterns = [
+            re.compile("|".join(parts[start : start + self.RULES_PER_PATTERN]))
+            for start in range(0, len(parts), self.RULES_PER_PATTERN)
+        ]
+        self.cache = {}
+
+    @classmethod
+    def from_file(cls, path):
+        """Read a rules file, raising ValueError (with the line number) on a bad rule"""
+        rules = []
+        with open(path) as f:
+            for number, line in enumerate(f, 1):
+                fields = line.split("#", 1)[0].split()
+                if not fields:
+                    continue
+                if len(fields) != 3 or fields[0] not in cls.KINDS:
+                    raise ValueError(
+                        "{}:{}: expected '<{}> <pattern> <service>'".format(
+                            path, number, "|".join(cls.KINDS)
+                        )
+                    )
+                if fields[0] == "regex":
+                    try:
+                        re.compile(fields[1])
+                    except re.error as error:
+                        raise ValueError("{}:{}: {}".format(path, number, error))
+                rules.append(tuple(fields))
+        return cls(rules)
+
+    @staticmethod
+    def glob_to_regex(pattern):
+        """fnmatch.translate() without its flags, which can't be embedded in a larger pattern"""
+        regex = []
+        for char in pattern:
+            if char == "*":
+                regex.append(".*")
+            elif char == "?":
+                regex.append(".")
+            else:
+                regex.append(re.escape(char))
+        return "".join(regex)
+
+    def service(self, name):
+        service = self.cache.get(name)
+        if service is None:
+            service = name
+            for pattern in self.patterns:
+                match = pattern.match(name)
+                if match:
+                    service = self.services[int(match.lastgroup[1:])]
+                    break
+            if len(self.cache) >= self.CACHE_SIZE:
+                self.cache.clear()
+            self.cache[name] = service
+        return service
+
+
 class Printer(object):
     """
     Base class for all facts
@@ -73,6 +560,15 @@ class Printer(object):
     RED = "\033[1;31m"
     UNDERLINE = "\033[4m"
     RESET = "\033[0m"
+    COLOURS = {
+        "WHITE": WHITE,
+        "GREEN": GREEN,
+        "CYAN": CYAN,
+        "ORANGE": ORANGE,
+        "RED": RED,
+        "UNDERLINE": UNDERLINE,
+        "RESET": RESET,
+    }
 
     # Fact's severity
     NONE = 0  # no useful output
@@ -81,10 +577,18 @@ class Printer(object):
     WARN = 3
     CRIT = 4
     _severity = NONE
-    _lines = []
+    # Immutable so lines are never shared between instances by accident, subclasses that
+    # collect lines create their own list
+    _lines = ()
 
     HEADER = None
 
+    @staticmethod
+    def set_colour(enabled):
+        """Enable or disable ANSI colour codes for every printer"""
+        for attr, code in Printer.COLOURS.items():
+            setattr(Printer, attr, code if enabled else "")
+
     @property
     def spacer(self):
         return self.WHITE + self.horizontal_line + self.RESET
@@ -121,10 +625,55 @@ class Printer(object):
         return lines
 
 
+class Renderer(object):
+    """
+    Write report lines as soon as they are produced
+
+    Output goes to stdout, or to a pager when one is requested and stdout is a terminal,
+    so nothing has to hold the whole report in memory before the first line is shown.
+    """
+
+    def __init__(self, pager=None):
+        self._pager = None
+        if pager and sys.stdout.isatty():
+            try:
+                self._pager = subprocess.Popen(
+                    pager, shell=True, stdin=subprocess.PIPE, universal_newlines=True
+                )
+            except OSError:
+                self._pager = None
+
+    @property
+    def stream(self):
+        # Looked up on every write so a replaced sys.stdout (e.g. under test) is honoured
+        return self._pager.stdin if self._pager else sys.stdout
+
+    def write(self, lines):
+        """Write a block of lines in a single buffered write"""
+        if not lines:
+            return
+        self.stream.write("\n".join(lines) + "\n")
+
+    def close(self):
+        """Flush any buffered output and wait for the pager to exit"""
+        try:
+            self.stream.flush()
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
+        if self._pager:
+            try:
+                self._pager.stdin.close()
+            except IOError:
+                pass
+            self._pager.wait()
+            self._pager = None
+
+
 # }}}
 
 
-def main_header():
+def main_header(renderer=None):
     """
     Disclaimer and Script Header
     """
@@ -135,31 +684,28 @@ def main_header():
     disclaimer_text = "If the system OOMs too viciously, there may be nothing logged!"
     warning_text = "Do NOT take this script as FACT, ALWAYS investigate further."
 
-    print(colours.spacer)
-    print("      _____ _____ _____ ")
-    print("     |     |     |     |")
-    print("     |  |  |  |  | | | |")
-    print("     |_____|_____|_|_|_|")
-    print("     {}".format(analyzer_name))
-    print("")
-    print("\u00A9 {} {}".format(current_year, author_name))
-    print("")
-    print(
+    lines = [
+        colours.spacer,
+        "      _____ _____ _____ ",
+        "     |     |     |     |",
+        "     |  |  |  |  | | | |",
+        "     |_____|_____|_|_|_|",
+        "     {}".format(analyzer_name),
+        "",
+        "\u00A9 {} {}".format(current_year, author_name),
+        "",
         "{colours.RED}{colours.UNDERLINE}Disclaimer:{colours.RESET}".format(
             colours=colours
-        )
-    )
-    print(
+        ),
         "{colours.RED}{disclaimer_text}".format(
             colours=colours, disclaimer_text=disclaimer_text
-        )
-    )
-    print(
+        ),
         "{warning_text}{colours.RESET}".format(
             warning_text=warning_text, colours=colours
-        )
-    )
-    print(colours.spacer)
+        ),
+        colours.spacer,
+    ]
+    (renderer or Renderer()).write(lines)
 
 
 class System(Printer):
@@ -168,6 +714,7 @@ class System(Printer):
     def __init__(self):
         self.python_version = None
         self.distro, self.version, _ = self.get_distro_info()
+        self._lines = []
         self.log_files = []
         self.log_to_use = None
         self.journalctl = False
@@ -175,6 +722,12 @@ class System(Printer):
         self.find_system_logs()
         self.use_journalctl = False
         self.use_dmesg = False
+        # (source, log file) pairs to read together and merge by time, with --merge
+        self.merge_sources = []
+        # Read the log file's rotations along with it, with --rotated
+        self.read_rotated = False
+        # Process names rolled up into services, with --group-rules
+        self.service_groups = None
 
     def __str__(self):
         return self._system
@@ -308,16 +861,72 @@ class System(Printer):
         default log file (or specified log file)
         """
         log_directory = os.path.dirname(log_file)
-        log_file_pattern = os.path.basename(log_file) + "*"
 
         log_files = [
             os.path.join(root, name)
             for root, _, files in os.walk(log_directory)
             for name in files
-            if fnmatch.fnmatch(name, log_file_pattern)
+            if self.is_rotated_log(name, log_file)
         ]
         return sorted(log_files)
 
+    def rotated_logs(self, log_file):
+        """
+        `log_file` and its rotations as (path, (year, month) of the first line), oldest first.
+        Files are ordered by their first and last timestamps rather than by name, which puts
+        messages, messages-20240101 and messages.1.gz in the wrong order. Syslog has no year,
+        so it comes from each file's modification time.
+        """
+        logs = []
+        for path in self.search_log_dir(log_file):
+            first, last = self.log_time_range(path)
+            modified = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+
+            def with_file_year(key):
+                if not key:
+                    return ()
+                return (modified.year - (key[0] > modified.month),) + key
+
+            first, last = with_file_year(first), with_file_year(last)
+            logs.append((first, last or first, path, first[:2] or (modified.year, 1)))
+        return [(path, first_month) for _, _, path, first_month in sorted(logs)]
+
+    def log_time_range(self, log_file, max_lines=1000):
+        """
+        Time keys (see line_time_key) of the first and last timestamped lines of a log. The
+        last is only looked up in uncompressed files, by reading back from the end.
+        """
+        first = last = None
+        with open_binary(log_file) as f:
+            for raw in itertools.islice(f, max_lines):
+                first = line_time_key(raw)
+                if first:
+                    break
+        if log_file.endswith(".gz"):
+            return first, None
+        with open(log_file, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 64 * 1024))
+            for raw in reversed(f.read().split(b"\n")):
+                last = line_time_key(raw)
+                if last:
+                    break
+        return first, last
+
+    def is_rotated_log(self, name, log_file):
+        """Check if `name` is `log_file` or one of its rotations (messages.1, messages-2024.gz)"""
+        return fnmatch.fnmatch(os.path.basename(name), os.path.basename(log_file) + "*")
+
+    def is_archived_log(self, member_name):
+        """Check if an archive member is one of the logs we know how to read"""
+        # sosreports wrap everything in a top level sosreport-<host>-<date>/ directory
+        for directory, log_name in ARCHIVE_LOGS:
+            if fnmatch.fnmatch(
+                os.path.dirname(member_name), "*" + directory
+            ) and self.is_rotated_log(member_name, log_name):
+                return True
+        return False
+
     def get_ram_info(self):
         try:
             mem_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
@@ -345,34 +954,127 @@ class System(Printer):
         ]
         self._lines.append("")
 
-    def print_pretty(self):
+    def print_pretty(self, renderer=None):
         self.populate_lines()
 
-        print()
-        for line in self._lines:
-            print(line)
+        (renderer or Renderer()).write([""] + self._lines)
 
 
 class OOMAnalyzer(Printer):
     """Class to analyze OOM logs"""
 
-    def __init__(self, system):
+    # A process table is considered finished, even without a "Killed process" line, once
+    # this many other lines or seconds have passed since its last row
+    TABLE_GAP_LINES = 200
+    TABLE_GAP_SECONDS = 60
+    # How often (in lines) to check our own memory use when a limit is set
+    RSS_CHECK_INTERVAL = 4096
+    # --gentle: read size, how long to pause for (in total, per check) while memory pressure
+    # (PSI some avg10, %) is above the limit, and the --max-rss used when none is given
+    GENTLE_CHUNK = 256 * 1024
+    GENTLE_PSI_LIMIT = 10.0
+    GENTLE_PAUSE = 1
+    GENTLE_MAX_PAUSE = 60
+    GENTLE_MAX_RSS = 200
+    # With --merge: how many recent lines to look in for another source's copy of a line, and
+    # how many batches of lines each source may read ahead
+    MERGE_WINDOW = 20000
+    MERGE_QUEUE_BATCHES = 16
+    # Process table columns that count towards the kernel's badness score
+    BADNESS_COLUMNS = (
+        "swapents",
+        "pgtables_bytes",
+        "nr_ptes",
+        "nr_pmds",
+        "oom_score_adj",
+    )
+    OOM_SCORE_ADJ_MIN = -1000
+    # Kill candidates kept per incident with --explain
+    CANDIDATES = 10
+    ROLLUPS = ("uid", "cgroup", "name")
+    # With printk caller ids: how often (in lines) to close the reports of tasks gone quiet
+    STALE_CHECK_LINES = 1000
+    # Longer context lines are cut short, so --context N holds at most N times this
+    CONTEXT_LINE_BYTES = 512
+    # Memory the kernel didn't say the cgroup of (only the victim's is logged in a global OOM)
+    UNATTRIBUTED_CGROUP = "(not logged)"
+    INDEX_DIR = os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "oom_investigate",
+    )
+    # How much of the start of a log its cached summary is keyed on
+    SUMMARY_HEAD_BYTES = 4096
+
+    def __init__(
+        self,
+        system,
+        budget=None,
+        max_rss=None,
+        explain=False,
+        adj_overrides=None,
+        group_by=None,
+        context=0,
+        only_host=None,
+        gentle=False,
+    ):
         self.system = system
+        # Read in small chunks, dropping them from the page cache, and pause while the box is
+        # under memory pressure
+        self.gentle = gentle
+        self.pressure = PressureMonitor(history=1) if gentle else None
+        # Only parse the lines of this host, for a central log holding several
+        self.only_host = only_host
+        # How many of the last non-kernel lines to keep with each incident
+        self.context = context
+        # Roll each incident's memory up by uid, cgroup and name as the table is read, and
+        # show the rollup for this dimension
+        self.group_by = group_by
+        self.uid_column = None
+        # Rank kill candidates by recomputing the kernel's badness score for each row, and
+        # the ranking if the named processes had these oom_score_adj values instead
+        self.adj_overrides = adj_overrides or {}
+        self.explain = explain or bool(self.adj_overrides)
+        self.badness_columns = {}
+        # Keep only the top `budget` process names per incident rather than every row
+        self.budget = budget
+        # Stop parsing (keeping what we have) if our own RSS grows past this many MB
+        self.max_rss = max_rss
+        self.truncated = False
+        # Logs read from inside an archive, in the order they were read
+        self.archive_members = []
         self.log_file = self.system.log_to_use
         self.oom_instances = []
         self.current_instance = None
         self.rss_column = 7
+        self.pid_column = 3
         self.log_start_time = None
         self.log_end_time = None
         self.oom_counter = 0
         self._get_log_source = None
-        self._system_ram = None
-        self._last_instance_system_ram = None
+        # Fingerprints of every incident reported so far. Kept for the lifetime of the
+        # analyzer so overlapping sources/rotations analyzed with it are only counted once
+        self._seen_fingerprints = set()
+        self.duplicates = 0
+        # Lines dropped from --merge because another source already had them
+        self.merged_duplicates = 0
+        # Log files read with --rotated, oldest first
+        self.rotated_files = []
+        # incident number -> (start, end) byte offsets in the log
+        self.incident_offsets = {}
+        # (start, end) of every incident's block, duplicates included
+        self.block_offsets = []
+        # Process tables seen by the last analyze(), --quick's count
+        self.oom_starts = 0
+        # Only the most recent incidents were read, see analyze_recent()
+        self.recent_only = False
 
     def get_log_source(self, log_file=None, journalctl=None, dmesg=None):
         """Method to get the log source, allowing for manual override"""
         if self._get_log_source:
             return self._get_log_source
+        if self.system.merge_sources:
+            self._get_log_source = "merged"
+            return self._get_log_source
 
         log_sources = [
             ("dmesg", dmesg, self.system.use_dmesg),
@@ -396,16 +1098,32 @@ class OOMAnalyzer(Printer):
                     chosen_source = source
 
         self._get_log_source = chosen_source or "file"
+        if (
+            self._get_log_source == "file"
+            and self.system.read_rotated
+            and not is_archive(self.log_file)
+        ):
+            self._get_log_source = "rotated"
         return self._get_log_source
 
     def log_lines(self, source, log_file=None):
-        """Method to return log lines from different sources"""
+        """
+        Method to return raw (undecoded) log lines from different sources. Decoding is left to
+        the caller so that only the lines it actually needs are decoded.
+        """
         # If log file is specified, read from that file
-        if source == "file":
+        if source == "file" and is_archive(log_file or self.log_file):
+            for _, lines in self.archive_logs(log_file or self.log_file):
+                for line in lines:
+                    yield line
+        elif source == "file" and self.gentle:
+            for line in self.gentle_lines(log_file or self.log_file):
+                yield line
+        elif source == "file":
             log_file_to_read = log_file or self.log_file
-            with open_file(log_file_to_read) as file:
+            with open_binary(log_file_to_read) as file:
                 for line in file:
-                    yield line.strip()
+                    yield line
         # If system.use_journalctl is True, read from journalctl
         elif source == "journalctl":
             cmd = "journalctl -o short-iso --no-pager --boot=-0 -k"
@@ -413,7 +1131,7 @@ class OOMAnalyzer(Printer):
                 cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
             )
             for line in p.stdout:
-                yield line.decode("utf-8")
+                yield line
         # If system.dmsg is True, read from dmesg
         elif source == "dmesg":
             cmd = "dmesg"
@@ -421,55 +1139,323 @@ class OOMAnalyzer(Printer):
                 cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
             )
             for line in p.stdout:
-                yield line.decode("utf-8")
+                yield line
+        elif source == "merged":
+            for line in self.merged_lines():
+                yield line
+        elif source == "rotated":
+            for line in self.rotated_lines():
+                yield line
+
+    def gentle_lines(self, log_file):
+        """A log file's lines read in GENTLE_CHUNK chunks, dropped from the page cache"""
+        with open(log_file, "rb") as file:
+            chunks = iter_dropping_cache(file, self.GENTLE_CHUNK)
+            if log_file.endswith(".gz"):
+                chunks = iter_gunzip(chunks)
+            for line in iter_lines(chunks):
+                yield line
+
+    def back_off(self):
+        """--gentle: wait while the box is under memory pressure, up to GENTLE_MAX_PAUSE"""
+        paused = 0
+        while paused < self.GENTLE_MAX_PAUSE:
+            if self.pressure.sample().get("some", 0) <= self.GENTLE_PSI_LIMIT:
+                break
+            time.sleep(self.GENTLE_PAUSE)
+            paused += self.GENTLE_PAUSE
+        return paused
+
+    def merged_lines(self):
+        """
+        Read every source in system.merge_sources at once and merge them into a single stream
+        ordered by time. Each source is read ahead by its own thread, so reading them all
+        takes about as long as reading the slowest. A kernel line already seen from another
+        source (within MERGE_WINDOW lines) is dropped, so each message is parsed once.
+        """
+        sources = self.system.merge_sources
+        booted = boot_time() if ("dmesg", None) in sources else None
+        streams = []
+        for source, log_file in sources:
+            batches = queue.Queue(maxsize=self.MERGE_QUEUE_BATCHES)
+            reader = threading.Thread(
+                target=read_ahead,
+                args=(self.log_lines(source, log_file=log_file), batches),
+            )
+            # Don't hold up exit if parsing stops before a source is drained
+            reader.daemon = True
+            reader.start()
+            streams.append(iter_queue(batches))
+        return self.drop_repeated_lines(
+            merge_by_time(streams, booted), len(streams), line_body
+        )
+
+    def rotated_lines(self):
+        """
+        The log file and all of its rotations read as one stream in time order, so an incident
+        split across a rotation is read whole and incidents are numbered in the order they
+        happened. Lines repeated at the start of the next file (copytruncate) are dropped.
+        """
+        logs = self.system.rotated_logs(self.log_file)
+        self.rotated_files = [log_file for log_file, _ in logs]
+        streams = [self.log_lines("file", log_file=log_file) for log_file, _ in logs]
+        return self.drop_repeated_lines(
+            merge_by_time(streams, years=[first for _, first in logs]),
+            len(streams),
+            lambda raw: raw.strip(),
+        )
 
-    def analyze(self):
-        """Method to parse the log and analyze OOM incidents"""
+    def drop_repeated_lines(self, merged, stream_count, line_key):
+        """
+        Yield lines from merge_by_time() output, dropping any line whose key matches a line
+        from another stream within the last MERGE_WINDOW lines. Copies are paired off one to
+        one, so a line repeated within a single stream is kept.
+        """
+        # key -> copies from each stream not yet matched with a copy from another stream
+        unmatched = {}
+        window = deque()
+        for index, raw in merged:
+            body = line_key(raw)
+            copies = unmatched.get(body)
+            if copies is None:
+                copies = unmatched[body] = [0] * stream_count
+            else:
+                other = [i for i, count in enumerate(copies) if count and i != index]
+                if other:
+                    copies[other[0]] -= 1
+                    self.merged_duplicates += 1
+                    continue
+            copies[index] += 1
+            window.append((body, index))
+            if len(window) > self.MERGE_WINDOW:
+                old_body, old_index = window.popleft()
+                old_copies = unmatched[old_body]
+                if old_copies[old_index]:
+                    old_copies[old_index] -= 1
+                if not any(old_copies):
+                    del unmatched[old_body]
+            yield raw
+
+    def archive_logs(self, archive):
+        """
+        Yield (member name, raw lines) for every log inside a tar archive, streamed straight
+        out of the archive in a single pass without extracting anything to disk.
+        """
+        with tarfile.open(archive, "r|*") as tar:
+            for member in tar:
+                if not member.isfile() or not self.system.is_archived_log(member.name):
+                    continue
+                chunks = iter_chunks(tar.extractfile(member))
+                if member.name.endswith(".gz"):
+                    chunks = iter_gunzip(chunks)
+                self.archive_members.append(member.name)
+                # Members must be consumed before moving on as the archive is a stream
+                yield member.name, iter_lines(chunks)
+
+    def analyze(self, log_file=None, lines=None):
+        """
+        Method to parse the log and analyze OOM incidents. `lines` parses the given raw lines
+        instead of the log, e.g. a single incident read back using the offset index.
+        """
+        # A summary of the file (incident offsets, counts, first and last lines) is cached,
+        # see summary_path(). Only written after reading the whole file.
+        summary_path = (
+            self.summary_path(log_file)
+            if lines is None and self.only_host is None
+            else None
+        )
+        # With a cached summary only the incidents' blocks are read, not the whole file
+        cached = self.cached_blocks(log_file) if summary_path else None
+        if cached is not None:
+            summary_path = None
+            lines = cached
+        # Whether every incident's block starts at its invoking line, so holds all of it
+        blocks_complete = [True]
+        scanned = {"oom_starts": 0, "first_line": None}
 
         # Prevent errors if log file is empty
-        log_generator = self.log_lines(self.get_log_source())
+        if lines is not None:
+            log_generator = iter(lines)
+        else:
+            log_generator = self.log_lines(self.get_log_source(), log_file=log_file)
         try:
             first_line = next(log_generator)
         except StopIteration:
-            return
-
-        state = {"found_killed": False}
-
-        # Extract the start timestamp from the line
-        if self.log_start_time is None:
-            self.log_start_time = self.extract_timestamp(first_line)
+            return iter(())
+
+        # The last non-blank line, for the log end time
+        last_line = [None]
+        # Each host has its own parser state (see host_state()), so the OOM dumps of hosts
+        # logging to one central syslog file are parsed independently of each other. Lines
+        # tagged with a printk caller id get a state per (host, caller), so reports printed
+        # at the same time by different tasks are also kept apart.
+        states = {}
+        # (host, caller) of states part way through an OOM block, whose every line has to
+        # be looked at
+        open_keys = set()
+        # Keys with a caller id. Each task's report is closed once it has gone quiet.
+        tagged = set()
+        # host -> the last non-kernel lines, with --context
+        contexts = {}
 
         def generator():
-            current_instance = None
-            line = None
-            for line in log_generator:
+            offset = 0
+            for line_count, raw in enumerate(
+                itertools.chain([first_line], log_generator), 1
+            ):
+                line_offset = offset
+                offset += len(raw)
+                if (
+                    self.max_rss
+                    and line_count % self.RSS_CHECK_INTERVAL == 0
+                    and current_rss_mb() > self.max_rss
+                ):
+                    # Better to report what we have than to push the box into an OOM
+                    self.truncated = True
+                    break
+                if self.gentle and line_count % self.RSS_CHECK_INTERVAL == 0:
+                    self.back_off()
+
+                # Remember the last non-blank line for the log end time
+                if len(raw) > 1:
+                    last_line[0] = raw
+                # Extract the start timestamp from the first line that has one
+                if self.log_start_time is None:
+                    self.log_start_time = self.extract_timestamp(decode_line(raw))
+                    if self.log_start_time is not None:
+                        scanned["first_line"] = decode_line(raw)
+
+                # Outside of an OOM block only marker lines are of interest, skip the rest
+                # without decoding them
+                marker = OOM_MARKERS.search(raw)
+                if tagged and line_count % self.STALE_CHECK_LINES == 0:
+                    for stale in self.close_stale(
+                        states, tagged, open_keys, line_count
+                    ):
+                        yield stale
+                if not marker and not open_keys and not self.context:
+                    continue
+                host = self.line_host(raw)
+                if self.only_host is not None and host != self.only_host:
+                    continue
+                key = (host, self.line_caller(raw))
+                if not marker and key not in open_keys:
+                    if self.context and not self.is_kernel_line(raw):
+                        if host not in contexts:
+                            contexts[host] = deque(maxlen=self.context)
+                        contexts[host].append(raw[: self.CONTEXT_LINE_BYTES])
+                    continue
+                state = states.get(key)
+                if state is None:
+                    state = states[key] = self.host_state()
+                    if key[1] is not None:
+                        tagged.add(key)
+                state["last_seen"] = line_count
+                current_instance = state["incident"]
+                line = decode_line(raw)
                 # Extract the ram from the system logs if possible
-                if not self._system_ram:
+                if not state["system_ram"]:
                     ram = self.get_ram_from_logs(line)
                     if ram:
-                        self._system_ram = round(ram)
+                        state["system_ram"] = round(ram)
+                invoked_by = self.parse_invoked_by(line)
+                if invoked_by:
+                    state["invoked_by"] = invoked_by
+                    state["meminfo"] = {}
+                    state["allocation"] = self.parse_allocation(line)
+                    state["numa"] = {
+                        "zones": {},
+                        "cpuset": None,
+                        "mems_allowed": None,
+                        "constraint": None,
+                    }
+                    state["block_start"] = line_offset
+                    state["context_lines"] = self.snapshot_context(contexts.get(host))
+                # Between the invoking line and the process table: collect the Mem-Info dump
+                elif state["invoked_by"] is not None and (
+                    self.parse_meminfo(line, state["meminfo"])
+                    or self.parse_buddy(line, state["allocation"])
+                    or self.parse_numa(line, state["numa"])
+                ):
+                    continue
                 # This is both the start of a new oom incident and the end of the previous one.
-                if self.is_oom_start(line):
+                elif self.is_oom_start(line):
+                    scanned["oom_starts"] += 1
+                    if state["invoked_by"] is None:
+                        blocks_complete[0] = False
                     line = self.strip_brackets_pid(line)
-                    self.oom_counter += 1
                     timestamp = self.extract_timestamp(line)
-                    self.rss_column = line.split().index("rss")
+                    header = line.split()
+                    state["columns"] = (
+                        header.index("rss"),
+                        header.index("pid"),
+                        header.index("uid") if "uid" in header else None,
+                        dict(
+                            (name, index)
+                            for index, name in enumerate(header)
+                            if name in self.BADNESS_COLUMNS
+                        ),
+                    )
                     # If we've already started an OOM incident, yield it and start a new one
                     if current_instance:
-                        current_instance["system_ram"] = "{:,.0f}".format(
-                            self._system_ram if self._system_ram else self.system.ram
-                        )
-                        yield current_instance
-                        self._last_instance_system_ram = self._system_ram
-                        self._system_ram = None
-                        state["found_killed"] = False
-                    current_instance = {
+                        if self.finish_incident(current_instance, state["system_ram"]):
+                            yield current_instance
+                        state["last_system_ram"] = state["system_ram"]
+                        state["system_ram"] = None
+                    state["found_killed"] = False
+                    state["lines_since_row"] = 0
+                    state["last_row"] = line
+                    current_instance = state["incident"] = {
                         "total_mb": 0,
                         "processes": [],
+                        "process_totals": TopK(self.budget) if self.budget else None,
                         "killed": [],
+                        "killed_pids": [],
+                        "table_hash": 0,
+                        "invoked_by": state["invoked_by"],
+                        "host": self.extract_hostname(line),
                         "start_time": timestamp,
-                        "incident_number": self.oom_counter,
+                        "incident_number": None,
+                        "meminfo": state["meminfo"],
+                        "total_pages": self.total_pages(state["meminfo"]),
+                        # Order, GFP flags and buddy free lists of the failed allocation
+                        "allocation": (
+                            state["allocation"]
+                            if state["invoked_by"] is not None
+                            else None
+                        ),
+                        # Free memory and watermarks of each zone, and the cpuset it ran in
+                        "numa": (
+                            state["numa"] if state["invoked_by"] is not None else None
+                        ),
+                        "candidates": [],
+                        "simulated": [] if self.adj_overrides else None,
+                        "rollups": (
+                            dict((key, {}) for key in self.ROLLUPS)
+                            if self.group_by
+                            else None
+                        ),
+                        # The cgroup a memcg OOM was confined to, from the oom-kill line
+                        "memcg": None,
+                        "context": (
+                            state["context_lines"]
+                            if state["invoked_by"] is not None
+                            else self.snapshot_context(contexts.get(host))
+                        ),
+                        # Byte offsets of the incident's block, from the invoking line
+                        "offsets": [
+                            (
+                                state["block_start"]
+                                if state["invoked_by"] is not None
+                                else line_offset
+                            ),
+                            offset,
+                        ],
                     }
+                    state["invoked_by"] = None
+                    state["meminfo"] = {}
+                    state["allocation"] = None
+                    state["numa"] = None
                 # Processing the new OOM incident
                 elif (
                     not state["found_killed"]
@@ -477,32 +1463,480 @@ class OOMAnalyzer(Printer):
                     and self.is_process_line(line)
                     and current_instance is not None
                 ):
+                    (
+                        self.rss_column,
+                        self.pid_column,
+                        self.uid_column,
+                        self.badness_columns,
+                    ) = state["columns"]
                     try:
                         processed_line = self.parse_process_line(line)
-                        current_instance["processes"].append(processed_line)
-                        current_instance["total_mb"] += processed_line["rss"]
                     except ValueError:
                         continue
+                    # Hashed before grouping, so fingerprints don't depend on the rules
+                    current_instance["table_hash"] = self.hash_process(
+                        processed_line, current_instance["table_hash"]
+                    )
+                    if self.system.service_groups:
+                        processed_line["name"] = self.system.service_groups.service(
+                            processed_line["name"]
+                        )
+                    if current_instance["process_totals"]:
+                        current_instance["process_totals"].add(
+                            processed_line["name"], processed_line["rss"]
+                        )
+                    else:
+                        current_instance["processes"].append(processed_line)
+                    current_instance["total_mb"] += processed_line["rss"]
+                    current_instance["offsets"][1] = offset
+                    if self.explain:
+                        self.add_candidate(current_instance, processed_line)
+                    if current_instance["rollups"] is not None:
+                        self.add_to_rollups(current_instance["rollups"], processed_line)
+                    state["lines_since_row"] = 0
+                    state["last_row"] = line
+                elif self.is_oom_kill_summary(line) and current_instance is not None:
+                    summary = self.parse_oom_kill_summary(line)
+                    current_instance["memcg"] = summary.get("oom_memcg")
+                    if current_instance["numa"] is not None:
+                        for name in ("constraint", "cpuset", "mems_allowed"):
+                            if summary.get(name):
+                                current_instance["numa"][name] = summary[name]
+                    if current_instance["rollups"] is not None:
+                        current_instance["killed_cgroup"] = summary.get("task_memcg")
                 elif self.is_killed_process(line) and current_instance is not None:
                     state["found_killed"] = True
+                    if current_instance.get("killed_cgroup"):
+                        cgroups = current_instance["rollups"]["cgroup"]
+                        cgroup = current_instance.pop("killed_cgroup")
+                        cgroups[cgroup] = cgroups.get(
+                            cgroup, 0
+                        ) + self.parse_killed_rss(line)
+                    current_instance["offsets"][1] = offset
                     current_instance["killed"].append(
                         self.parse_killed_process_line(line)
                     )
+                    current_instance["killed_pids"].append(self.parse_killed_pid(line))
+                elif current_instance is not None and not state["found_killed"]:
+                    # No "Killed process" line yet. Close the table once we are clearly past
+                    # it, so rows from a later unrelated dump are never appended to it.
+                    state["lines_since_row"] += 1
+                    if state["lines_since_row"] == 1:
+                        # Only timestamp the last row when a gap starts, not every row
+                        state["last_row_time"] = self.extract_timestamp(
+                            state["last_row"]
+                        )
+                    timestamp = self.extract_timestamp(line)
+                    if timestamp and state["last_row_time"]:
+                        try:
+                            gap = (timestamp - state["last_row_time"]).total_seconds()
+                        except TypeError:
+                            gap = 0
+                        if gap > self.TABLE_GAP_SECONDS:
+                            state["found_killed"] = True
+                    if state["lines_since_row"] > self.TABLE_GAP_LINES:
+                        state["found_killed"] = True
+
+                if self.in_block(state):
+                    open_keys.add(key)
+                else:
+                    open_keys.discard(key)
 
-            if line:
-                self.log_end_time = self.extract_timestamp(line)
+            if last_line[0] and cached is None:
+                self.log_end_time = self.extract_timestamp(decode_line(last_line[0]))
 
-            # Yield the last OOM incident
-            if current_instance:
-                current_instance["system_ram"] = "{:,.0f}".format(
-                    self._last_instance_system_ram
-                    if self._last_instance_system_ram
-                    else self.system.ram
+            # Yield the last OOM incident of each host, in log order
+            last_incidents = sorted(
+                (state["incident"]["offsets"][0], key)
+                for key, state in states.items()
+                if state["incident"]
+            )
+            for _, key in last_incidents:
+                state = states[key]
+                if self.finish_incident(
+                    state["incident"], state["system_ram"] or state["last_system_ram"]
+                ):
+                    yield state["incident"]
+
+            self.oom_starts = scanned["oom_starts"]
+            if summary_path and not self.truncated:
+                self.save_summary(
+                    summary_path,
+                    log_file or self.log_file,
+                    oom_starts=scanned["oom_starts"],
+                    first_line=scanned["first_line"],
+                    last_line=last_line[0] and decode_line(last_line[0]),
+                    offsets=(
+                        blocks_complete[0]
+                        and not (log_file or self.log_file).endswith(".gz")
+                    ),
                 )
-                yield current_instance
 
+        if cached is not None:
+            return self.with_cached_offsets(generator())
         return generator()
 
+    def can_read_backwards(self):
+        """Whether the log is a plain file that recent incidents can be read from the end of"""
+        return (
+            self.get_log_source() == "file"
+            and not self.log_file.endswith(".gz")
+            and not is_archive(self.log_file)
+        )
+
+    def analyze_recent(self, count, storm_gap=None):
+        """
+        The last `count` incidents of the log, newest first, found by reading it backwards
+        from the end. Only their blocks are parsed. With `storm_gap`, enough incidents are
+        read for the last `count` storms (incidents under storm_gap seconds apart).
+
+        Incidents are numbered from the start of the log, using the count from its cached
+        summary, or else a quick forward count of process tables (no parsing).
+        """
+        gap = datetime.timedelta(seconds=storm_gap or 0)
+        region_start = None
+        # Whether region_start is already at the invoking line of the oldest table kept
+        found_invoking = False
+        groups, newest_time = 0, None
+        with open(self.log_file, "rb") as f:
+            for offset, raw in iter_reversed_lines(f):
+                if OOM_START.search(raw):
+                    time = self.extract_timestamp(decode_line(raw))
+                    if (
+                        groups == 0
+                        or time is None
+                        or newest_time is None
+                        or abs(newest_time - time) > gap
+                    ):
+                        if groups == count:
+                            break
+                        groups += 1
+                    newest_time = time
+                    region_start, found_invoking = offset, False
+                elif (
+                    region_start is not None
+                    and not found_invoking
+                    and b"invoked oom-killer" in raw
+                ):
+                    region_start, found_invoking = offset, True
+        if region_start is None:
+            return []
+
+        incidents = list(self.analyze(lines=self.lines_from(region_start)))
+        summary = self.load_summary()
+        if summary and summary.get("incidents") is not None:
+            total = len(summary["incidents"])
+        elif summary:
+            total = summary["oom_starts"]
+        else:
+            total = self.count_oom_starts()
+        total = max(total, len(incidents))
+        first = total - len(incidents)
+        self.incident_offsets = {}
+        for incident in incidents:
+            incident["incident_number"] += first
+            incident["offsets"] = [
+                region_start + position for position in incident["offsets"]
+            ]
+            self.incident_offsets[incident["incident_number"]] = tuple(
+                incident["offsets"]
+            )
+        self.oom_counter = total
+        self.recent_only = True
+        # The region's first line isn't the log's
+        self.log_start_time = None
+        if summary and summary.get("first_line"):
+            self.log_start_time = self.extract_timestamp(summary["first_line"])
+        # As analyze() does: from the first line that has a timestamp
+        if self.log_start_time is None:
+            for raw in self.lines_from(0):
+                self.log_start_time = self.extract_timestamp(decode_line(raw))
+                if self.log_start_time is not None:
+                    break
+        incidents.reverse()
+        return incidents
+
+    def lines_from(self, offset):
+        with open(self.log_file, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                yield line
+
+    def count_oom_starts(self):
+        """Count the log's process tables without parsing it, reading it in large chunks"""
+        count = 0
+        pending = b""
+        with open(self.log_file, "rb") as f:
+            for chunk in iter_chunks(f):
+                data = pending + chunk
+                cut = data.rfind(b"\n") + 1
+                count += len(OOM_START.findall(data, 0, cut))
+                pending = data[cut:]
+        return count + len(OOM_START.findall(pending))
+
+    def with_cached_offsets(self, incidents):
+        """Incidents parsed from cached blocks, given their offsets in the file itself"""
+        offsets = self.load_index()
+        for incident in incidents:
+            number = incident["incident_number"]
+            incident["offsets"] = list(offsets[number])
+            self.incident_offsets[number] = offsets[number]
+            yield incident
+
+    def cached_blocks(self, log_file=None):
+        """
+        The lines of every incident block in the log, read using its cached summary, or None
+        without a usable summary. Only the blocks are read, and the log's first and last
+        times are taken from the summary. Not used with --context, which needs the lines
+        in between. Overlapping blocks, of hosts or tasks whose reports were interleaved,
+        are read as one.
+        """
+        if self.context or (log_file and log_file != self.log_file):
+            return None
+        summary = self.load_summary()
+        if summary is None or summary.get("blocks") is None or not self.index_path():
+            return None
+        ranges = []
+        for start, end in summary["blocks"]:
+            # The blocks of hosts (or tasks) logging at the same time overlap: read them once
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+        # Don't trust a summary that doesn't match the file after all
+        with open(self.log_file, "rb") as f:
+            for start, _ in ranges:
+                f.seek(start)
+                if b"invoked oom-killer" not in f.readline():
+                    return None
+        for key, line in (
+            ("first_line", "log_start_time"),
+            ("last_line", "log_end_time"),
+        ):
+            if summary.get(key):
+                setattr(self, line, self.extract_timestamp(summary[key]))
+
+        def blocks():
+            for start, end in ranges:
+                for raw in self.read_block(start, end):
+                    yield raw
+
+        return blocks()
+
+    def host_state(self):
+        """The parser state of one host in the log"""
+        return {
+            "incident": None,
+            "found_killed": False,
+            "invoked_by": None,
+            "lines_since_row": 0,
+            "last_row": None,
+            "last_row_time": None,
+            "meminfo": {},
+            "allocation": None,
+            "numa": None,
+            "block_start": 0,
+            # The --context lines snapshotted for the next incident
+            "context_lines": None,
+            # rss, pid and uid columns and the badness columns of the last table header
+            "columns": (7, 3, None, {}),
+            # RAM from the "pages RAM" line of the last dump, and of the one before
+            "system_ram": None,
+            "last_system_ram": None,
+            # Line number of the last line seen for this state
+            "last_seen": 0,
+        }
+
+    def close_stale(self, states, tagged, open_keys, line_count):
+        """
+        Yield, and forget, the incidents of tasks (printk caller ids) with no lines in the
+        last TABLE_GAP_LINES lines. A task's report is printed in one go, so one that has gone
+        quiet is finished, even without a "Killed process" line.
+        """
+        stale = [
+            key
+            for key in tagged
+            if line_count - states[key]["last_seen"] > self.TABLE_GAP_LINES
+        ]
+        stale.sort(key=lambda key: states[key]["last_seen"])
+        for key in stale:
+            state = states.pop(key)
+            tagged.discard(key)
+            open_keys.discard(key)
+            ram = state["system_ram"] or state["last_system_ram"]
+            if state["incident"] and self.finish_incident(state["incident"], ram):
+                yield state["incident"]
+
+    def finish_incident(self, oom_instance, system_ram):
+        """Fill in the incident's RAM and complete it. False if it is a duplicate"""
+        oom_instance["system_ram"] = "{:,.0f}".format(
+            system_ram if system_ram else self.system.ram
+        )
+        return self.complete_incident(oom_instance)
+
+    def in_block(self, state):
+        """Whether a host is between an invoking line and the end of its process table"""
+        return state["invoked_by"] is not None or (
+            state["incident"] is not None and not state["found_killed"]
+        )
+
+    def line_caller(self, raw):
+        """The printk caller id (e.g. T1234) of a raw line, with CONFIG_PRINTK_CALLER"""
+        match = PRINTK_CALLER.search(raw)
+        return match.group(1) if match else None
+
+    def line_host(self, raw):
+        """The hostname field of a raw syslog or journalctl line, or None (e.g. dmesg)"""
+        match = HOSTNAME.match(raw)
+        return decode_line(match.group(1)) if match else None
+
+    def summary_path(self, log_file=None):
+        """
+        Where the cached summary of a log file is kept, or None for sources that aren't a
+        single file (archives, journalctl, dmesg). Summaries live in the user's cache
+        directory, keyed by the log's device, inode, size, modification time and a checksum
+        of its first SUMMARY_HEAD_BYTES, so a rotated, replaced or grown log never uses a
+        stale one, even when a recreated log reuses the inode and size.
+        """
+        log_file = log_file or self.log_file
+        if self.get_log_source() != "file" or not log_file or is_archive(log_file):
+            return None
+        try:
+            stat = os.stat(log_file)
+            with open(log_file, "rb") as f:
+                head = zlib.crc32(f.read(self.SUMMARY_HEAD_BYTES)) & 0xFFFFFFFF
+        except (IOError, OSError):
+            return None
+        return os.path.join(
+            self.INDEX_DIR,
+            "{}-{}-{}-{}-{:08x}.json".format(
+                stat.st_dev,
+                stat.st_ino,
+                stat.st_size,
+                int(stat.st_mtime * 1000000),
+                head,
+            ),
+        )
+
+    def index_path(self, log_file=None):
+        """
+        The summary holding the log's incident offset index, or None if byte offsets into it
+        can't be used (compressed logs, and the sources without a summary)
+        """
+        log_file = log_file or self.log_file
+        if log_file and log_file.endswith(".gz"):
+            return None
+        return self.summary_path(log_file)
+
+    def save_summary(
+        self, path, log_file, oom_starts, first_line=None, last_line=None, offsets=True
+    ):
+        """
+        Cache the summary of `log_file`: how many process tables (--quick's count) it has,
+        its first and last timed lines and, unless `offsets` is False, the offsets of every
+        incident found. An unwritable cache is ignored.
+        """
+        summary = {
+            "log": log_file,
+            "oom_starts": oom_starts,
+            "first_line": first_line,
+            "last_line": last_line,
+        }
+        if offsets:
+            summary["incidents"] = [
+                [number, start, end]
+                for number, (start, end) in self.incident_offsets.items()
+            ]
+            # Also the blocks of duplicates, which the incidents' blocks can overlap
+            summary["blocks"] = sorted(list(block) for block in self.block_offsets)
+        try:
+            if not os.path.isdir(self.INDEX_DIR):
+                os.makedirs(self.INDEX_DIR)
+            with open(path + ".tmp", "w") as f:
+                json.dump(summary, f)
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError):
+            pass
+
+    def load_summary(self, log_file=None):
+        """The log's cached summary, or None if there is none"""
+        path = self.summary_path(log_file)
+        if not path or not os.path.isfile(path):
+            return None
+        try:
+            with open(path) as f:
+                summary = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        # Written by an older version, with only the offset index
+        if "oom_starts" not in summary:
+            return None
+        return summary
+
+    def load_index(self):
+        """{incident number: (start, end)} from the log's index, or None if there is none"""
+        if not self.index_path():
+            return None
+        incidents = (self.load_summary() or {}).get("incidents")
+        if incidents is None:
+            return None
+        return dict((number, (start, end)) for number, start, end in incidents)
+
+    def read_block(self, start, end):
+        """The raw lines between two byte offsets of the log file"""
+        with open(self.log_file, "rb") as f:
+            f.seek(start)
+            return f.read(end - start).splitlines(True)
+
+    def fingerprint(self, oom_instance):
+        """
+        Compact fingerprint of an incident, built from the start time, invoking task, killed
+        pids and a hash of the process table. Timestamps are reduced to the minute with no year
+        or timezone so the syslog and journal copies of the same OOM match.
+        """
+        start_time = oom_instance.get("start_time")
+        key = "|".join(
+            [
+                start_time.strftime("%m-%d %H:%M") if start_time else "",
+                oom_instance.get("invoked_by") or "",
+                ",".join(str(pid) for pid in oom_instance["killed_pids"]),
+                "{:08x}".format(oom_instance["table_hash"] & 0xFFFFFFFF),
+            ]
+        )
+        return hashlib.sha1(encode_text(key)).hexdigest()[:16]
+
+    def complete_incident(self, oom_instance):
+        """Finish an incident's process data and pass it through the dedup stage"""
+        process_totals = oom_instance.pop("process_totals", None)
+        if process_totals:
+            oom_instance["processes"] = process_totals.as_processes()
+        for key in ("candidates", "simulated"):
+            if oom_instance.get(key) is not None:
+                oom_instance[key] = self.ranked_candidates(oom_instance[key])
+        oom_instance.pop("killed_cgroup", None)
+        if oom_instance.get("rollups") is not None:
+            self.complete_rollups(oom_instance)
+        return self.register_incident(oom_instance)
+
+    def register_incident(self, oom_instance):
+        """
+        Dedup stage: number the incident and return True if it hasn't been seen before.
+        Duplicates are counted and dropped before any rendering work is done on them.
+        """
+        if "offsets" in oom_instance:
+            self.block_offsets.append(tuple(oom_instance["offsets"]))
+        fingerprint = self.fingerprint(oom_instance)
+        if fingerprint in self._seen_fingerprints:
+            self.duplicates += 1
+            return False
+        self._seen_fingerprints.add(fingerprint)
+        self.oom_counter += 1
+        oom_instance["fingerprint"] = fingerprint
+        oom_instance["incident_number"] = self.oom_counter
+        if "offsets" in oom_instance:
+            self.incident_offsets[self.oom_counter] = tuple(oom_instance["offsets"])
+        return True
+
     def strip_brackets_pid(self, log_line):
         return log_line.replace("[", "").replace("]", "")
 
@@ -522,7 +1956,195 @@ class OOMAnalyzer(Printer):
         rss = int(fields[self.rss_column])
         rss_mb = rss * 4 // 1024
         name = fields[-1]
-        return {"rss": rss_mb, "name": name}
+        process = {"pid": int(fields[self.pid_column]), "rss": rss_mb, "name": name}
+        if self.uid_column is not None:
+            process["uid"] = int(fields[self.uid_column])
+        if self.explain:
+            process["badness"], process["adj"] = self.badness(fields, rss)
+        return process
+
+    def badness(self, fields, rss):
+        """
+        The kernel's oom_badness() points (before oom_score_adj) and the oom_score_adj of a
+        process table row: rss + swap entries + page tables, all in pages. Older kernels log
+        fewer columns, so their points are approximated from what they do log.
+        """
+        columns = self.badness_columns
+        points = rss
+        if "swapents" in columns:
+            points += int(fields[columns["swapents"]])
+        if "pgtables_bytes" in columns:
+            points += int(fields[columns["pgtables_bytes"]]) // 4096
+        for name in ("nr_ptes", "nr_pmds"):
+            if name in columns:
+                points += int(fields[columns[name]])
+        adj = int(fields[columns["oom_score_adj"]]) if "oom_score_adj" in columns else 0
+        return points, adj
+
+    def total_pages(self, meminfo):
+        """RAM plus swap in pages, which oom_score_adj is scaled against"""
+        if meminfo.get("ram"):
+            return (meminfo["ram"] + meminfo.get("swap_total", 0)) // 4
+        return int((self.system.ram or 0) * 256)
+
+    def add_candidate(self, oom_instance, process):
+        """Keep the incident's top kill candidates, by real and by simulated oom_score_adj"""
+        self.push_candidate(
+            oom_instance["candidates"], oom_instance, process, process["adj"]
+        )
+        if oom_instance["simulated"] is not None:
+            adj = self.adj_overrides.get(process["name"], process["adj"])
+            self.push_candidate(oom_instance["simulated"], oom_instance, process, adj)
+
+    def push_candidate(self, heap, oom_instance, process, adj):
+        # Like the kernel: -1000 is never killed and adj is scaled to the memory available
+        if adj == self.OOM_SCORE_ADJ_MIN:
+            return
+        points = process["badness"] + adj * (oom_instance["total_pages"] // 1000)
+        entry = (points, process["pid"], process["name"], adj)
+        if len(heap) < self.CANDIDATES:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heappushpop(heap, entry)
+
+    def ranked_candidates(self, heap):
+        return [
+            {"badness": points, "pid": pid, "name": name, "adj": adj}
+            for points, pid, name, adj in sorted(heap, reverse=True)
+        ]
+
+    def hash_process(self, process, table_hash=0):
+        """Fold a process table row into the incident's running table hash"""
+        row = "{pid}:{rss}:{name}".format(**process)
+        return zlib.crc32(encode_text(row), table_hash)
+
+    def parse_invoked_by(self, line):
+        """Return the task name from an 'invoked oom-killer' line"""
+        match = re.search(r"(\S+) invoked oom-killer", line)
+        if match:
+            return match.group(1)
+        return None
+
+    def parse_allocation(self, line):
+        """
+        The order and GFP flags of the allocation that invoked the OOM killer. Kernels that
+        don't print the flag names are assumed to use the pre-4.4 bit layout. Returns None
+        if the line doesn't log them.
+        """
+        match = ALLOCATION.search(line)
+        if not match:
+            return None
+        gfp_mask, names, order = match.groups()
+        if names:
+            flags = names.split("|")
+        else:
+            mask = int(gfp_mask, 16)
+            flags = [name for bit, name in LEGACY_GFP_FLAGS if mask & bit]
+            unknown = mask & ~sum(bit for bit, _ in LEGACY_GFP_FLAGS)
+            if unknown:
+                flags.append(hex(unknown))
+        return {
+            "gfp_mask": gfp_mask,
+            "gfp_flags": flags,
+            "order": int(order),
+            # Free blocks per order (4kB << order), by zone
+            "free_blocks": {},
+        }
+
+    def parse_buddy(self, line, allocation):
+        """Add a zone's buddy free list counts to `allocation`. Returns True if found."""
+        match = BUDDY_ZONE.search(line)
+        if not match or allocation is None:
+            return False
+        allocation["free_blocks"][match.group(1)] = [
+            int(count) for count, _ in BUDDY_BLOCKS.findall(match.group(2))
+        ]
+        return True
+
+    def allocation_failure(self, oom_instance):
+        """
+        "fragmentation" when a zone the allocation could use had free memory above its min
+        watermark but no zone had a free block of the order needed, "exhaustion" when
+        memory had simply run out, or None when it can't be told from the log. The DMA zone
+        is left out: its large blocks are kept back from other allocations (lowmem_reserve).
+        """
+        allocation = oom_instance.get("allocation")
+        if not allocation or allocation["order"] < 0:
+            return None
+        order = allocation["order"]
+        if order == 0:
+            return "exhaustion"
+        free_blocks = dict(
+            (zone, counts)
+            for zone, counts in allocation["free_blocks"].items()
+            if zone.split()[-1] != "DMA"
+        )
+        if any(sum(counts[order:]) for counts in free_blocks.values()):
+            return "exhaustion"
+        watermarks = (oom_instance.get("numa") or {}).get("zones", {})
+        zones = [watermarks[zone] for zone in free_blocks if zone in watermarks]
+        if not zones:
+            return None
+        if any(free > min_kb for free, min_kb, _, _ in zones):
+            return "fragmentation"
+        return "exhaustion"
+
+    def parse_numa(self, line, numa):
+        """
+        Add a zone's free memory and min, low and high watermarks (in kB), or the cpuset
+        line, to `numa`. Returns True if either was found.
+        """
+        if numa is None:
+            return False
+        match = ZONE_WATERMARKS.search(line)
+        if match:
+            values = dict(WATERMARKS.findall(line))
+            numa["zones"][match.group(1)] = [
+                int(values.get(name, 0)) for name in ("free", "min", "low", "high")
+            ]
+            return True
+        match = CPUSET.search(line)
+        if match:
+            numa["cpuset"], numa["mems_allowed"] = match.groups()
+            return True
+        return False
+
+    def numa_exhaustion(self, oom_instance):
+        """
+        Per node totals of the incident's zones, and which nodes were exhausted (a zone at or
+        below its low watermark, where reclaim starts) or, of the others, had memory to
+        spare (free above the node's high watermarks). Also whether the OOM was confined to
+        some nodes, by a cpuset or memory policy, or by a mems_allowed narrower than the
+        nodes logged. Returns None without any zones.
+        """
+        numa = oom_instance.get("numa")
+        if not numa or not numa["zones"]:
+            return None
+        nodes = {}
+        for zone, watermarks in numa["zones"].items():
+            node = int(zone.split()[1])
+            totals = nodes.setdefault(node, [0, 0, 0, 0])
+            for index, kb in enumerate(watermarks):
+                totals[index] += kb
+        exhausted = set(
+            int(zone.split()[1])
+            for zone, (free, _, low, _) in numa["zones"].items()
+            if free <= low
+        )
+        allowed = parse_node_list(numa["mems_allowed"])
+        return {
+            "nodes": nodes,
+            "exhausted": sorted(exhausted),
+            "spare": sorted(
+                node
+                for node, (free, _, _, high) in nodes.items()
+                if node not in exhausted and free > high
+            ),
+            "constrained": (
+                numa["constraint"] in ("CONSTRAINT_CPUSET", "CONSTRAINT_MEMORY_POLICY")
+                or (allowed is not None and not set(nodes) <= allowed)
+            ),
+        }
 
     def get_ram_from_logs(self, line):
         """Method to return the RAM indicated in the logs, rather than the host machine"""
@@ -538,19 +2160,137 @@ class OOMAnalyzer(Printer):
             return int(m.group(1)) / 1024
         return None
 
-    def is_killed_process(self, line):
-        """Check if the line is a killed process line"""
-        return "killed process" in line.lower()
-
-    def parse_killed_process_line(self, line):
-        """Extract the name of the killed process"""
-        match = re.search(
-            r"Killed process \d+(?:, UID \d+)?, \((\S+)\)|Killed process \d+ \((\S+)\)",
-            line,
-            re.IGNORECASE,
-        )
+    def parse_meminfo(self, line, meminfo):
+        """
+        Add any Mem-Info counters on the line to `meminfo` (in kB). The system wide counters
+        are logged in pages, one or more per line (joined with #012 by rsyslog), while the
+        per node lines repeat them in kB and are skipped. Returns True if anything was found.
+        """
+        found = False
+        for name, pages in MEMINFO_COUNTERS.findall(line):
+            meminfo[name] = int(pages) * 4
+            found = True
+        for name, pattern in MEMINFO_TOTALS:
+            match = pattern.search(line)
+            if match:
+                value = int(match.group(1))
+                meminfo[name] = value * 4 if name in ("pagecache", "ram") else value
+                found = True
+        return found
+
+    def memory_breakdown(self, oom_instance):
+        """
+        Where the memory went, in MB, from the incident's Mem-Info counters. "unaccounted" is
+        whatever RAM isn't process RSS, slab, page cache or free: usually kernel allocations
+        that aren't slab (drivers, vmalloc, hugepages) or memory pinned outside of any process.
+        Returns None if the incident didn't log a Mem-Info dump.
+        """
+        meminfo = oom_instance.get("meminfo")
+        if not meminfo or "free" not in meminfo:
+            return None
+        ram_kb = meminfo.get("ram") or (
+            int(str(oom_instance["system_ram"]).replace(",", "")) * 1024
+        )
+        pagecache_kb = meminfo.get("pagecache")
+        if pagecache_kb is None:
+            pagecache_kb = (
+                meminfo.get("active_file", 0)
+                + meminfo.get("inactive_file", 0)
+                + meminfo.get("shmem", 0)
+            )
+        slab_kb = meminfo.get("slab_reclaimable", 0) + meminfo.get(
+            "slab_unreclaimable", 0
+        )
+        rss_kb = oom_instance["total_mb"] * 1024
+        breakdown = {
+            "ram": ram_kb,
+            "rss": rss_kb,
+            "pagecache": pagecache_kb,
+            "shmem": meminfo.get("shmem", 0),
+            "slab": slab_kb,
+            "slab_unreclaimable": meminfo.get("slab_unreclaimable", 0),
+            "pagetables": meminfo.get("pagetables", 0),
+            "free": meminfo["free"],
+            "unaccounted": ram_kb - rss_kb - slab_kb - pagecache_kb - meminfo["free"],
+            "swap_used": meminfo.get("swap_total", 0) - meminfo.get("swap_free", 0),
+            "swap_total": meminfo.get("swap_total", 0),
+        }
+        return dict((name, kb // 1024) for name, kb in breakdown.items())
+
+    def is_kernel_line(self, raw):
+        # Syslog and journalctl kernel lines, or a dmesg line
+        return b" kernel: " in raw or raw.startswith(b"[")
+
+    def snapshot_context(self, context):
+        """The lines kept before an incident, decoded. Each is only given to one incident"""
+        if not self.context:
+            return None
+        if context is None:
+            return []
+        lines = [decode_line(raw).rstrip("\r\n") for raw in context]
+        context.clear()
+        return lines
+
+    def add_to_rollups(self, rollups, process):
+        for key in ("uid", "name"):
+            if key in process:
+                rollups[key][process[key]] = (
+                    rollups[key].get(process[key], 0) + process["rss"]
+                )
+
+    def complete_rollups(self, oom_instance):
+        """
+        Only the victim's cgroup is logged (in the oom-kill line), so the rest of the table is
+        put under the cgroup a memcg OOM was confined to, or left unattributed
+        """
+        cgroups = oom_instance["rollups"]["cgroup"]
+        rest = oom_instance["total_mb"] - sum(cgroups.values())
+        if rest > 0:
+            cgroup = oom_instance["memcg"] or self.UNATTRIBUTED_CGROUP
+            cgroups[cgroup] = cgroups.get(cgroup, 0) + rest
+        # JSON object keys are strings
+        oom_instance["rollups"]["uid"] = dict(
+            (str(uid), mb) for uid, mb in oom_instance["rollups"]["uid"].items()
+        )
+
+    def is_oom_kill_summary(self, line):
+        """The oom-kill:constraint=...,task_memcg=...,task=...,pid=...,uid=... line"""
+        return "oom-kill:" in line
+
+    def parse_oom_kill_summary(self, line):
+        fields = line.split("oom-kill:", 1)[1].strip().split(",")
+        return dict(field.split("=", 1) for field in fields if "=" in field)
+
+    def parse_killed_rss(self, line):
+        """The victim's RSS in MB, from the anon/file/shmem-rss of its Killed process line"""
+        return (
+            sum(int(kb) for kb in re.findall(r"(?:anon|file|shmem)-rss:(\d+)kB", line))
+            // 1024
+        )
+
+    def is_killed_process(self, line):
+        """Check if the line is a killed process line"""
+        return "killed process" in line.lower()
+
+    def parse_killed_process_line(self, line):
+        """Extract the name of the killed process"""
+        match = re.search(
+            r"Killed process \d+(?:, UID \d+)?, \((\S+)\)|Killed process \d+ \((\S+)\)",
+            line,
+            re.IGNORECASE,
+        )
+        if match:
+            name = match.group(1) or match.group(2)
+            if self.system.service_groups:
+                return self.system.service_groups.service(name)
+            return name
+        return None
+
+    def parse_killed_pid(self, line):
+        """Extract the pid of the killed process"""
+        match = re.search(r"Killed process (\d+)", line, re.IGNORECASE)
         if match:
-            return match.group(1) or match.group(2)
+            return int(match.group(1))
         return None
 
     def extract_timestamp(self, line):
@@ -582,6 +2322,16 @@ class OOMAnalyzer(Printer):
 
         return time
 
+    def extract_hostname(self, line):
+        """Return the hostname field of a syslog or journalctl line, if there is one"""
+        match = re.match(
+            r"(?:\w{3}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2}|\d{4}-\d{2}-\d{2}T\S+)\s+(\S+)\s",
+            line,
+        )
+        if match:
+            return match.group(1)
+        return None
+
     def sorted_results(self, oom_processes_list):
         """Method to sort the OOM processes by RSS"""
         result = {}
@@ -589,12 +2339,14 @@ class OOMAnalyzer(Printer):
         for item in oom_processes_list:
             process = item["name"]
             rss = item["rss"]
+            # Rows aggregated while parsing (see --budget) carry their own count
+            instances = item.get("count", 1)
             if process in result:
                 result[process] += rss
-                count[process] += 1
+                count[process] += instances
             else:
                 result[process] = rss
-                count[process] = 1
+                count[process] = instances
         return sorted(result.items(), key=lambda x: x[1], reverse=True), count
 
     def quick_check(self):
@@ -604,6 +2356,13 @@ class OOMAnalyzer(Printer):
         all_log_files = []
         if source in ["journalctl", "dmesg"]:
             all_log_files.append((source, None))
+        elif source == "merged":
+            all_log_files.extend(self.system.merge_sources)
+        elif is_archive(self.log_file):
+            all_logs = {}
+            for name, lines in self.archive_logs(self.log_file):
+                all_logs[name] = sum(1 for raw in lines if OOM_START.search(raw))
+            return all_logs
         else:
             all_log_files.extend(
                 ("file", log) for log in self.system.search_log_dir(self.log_file)
@@ -611,21 +2370,97 @@ class OOMAnalyzer(Printer):
 
         all_logs = {}
         for src, log in all_log_files:
-            count = 0
-            generator = self.log_lines(src, log_file=log)
+            all_logs[log or src] = self.quick_count(src, log)
+        return all_logs
 
-            # Prevent errors if log file is empty
-            try:
-                _ = next(generator)
-            except StopIteration:
-                all_logs[log] = count
-                continue
+    def quick_count(self, source, log_file=None):
+        """
+        How many process tables a log has. A file's count comes from its cached summary when
+        there is one. Otherwise the file is read and the count cached: the selected log is
+        fully analyzed in that same pass, so a full analysis afterwards only has to read its
+        incidents back, and other files are just counted.
+        """
+        summary_path = self.summary_path(log_file) if source == "file" else None
+        summary = self.load_summary(log_file) if summary_path else None
+        if summary is not None:
+            return summary["oom_starts"]
+        if summary_path and log_file == self.log_file and self.only_host is None:
+            for _ in self.analyze():
+                pass
+            return self.oom_starts
+        count = 0
+        for raw in self.log_lines(source, log_file=log_file):
+            if OOM_START.search(raw):
+                count += 1
+        if summary_path:
+            self.save_summary(summary_path, log_file, count, offsets=False)
+        return count
+
+    def print_pretty_memory_breakdown(self, oom_instance):
+        breakdown = self.memory_breakdown(oom_instance)
+        if breakdown is None:
+            return []
 
-            for line in generator:
-                if self.is_oom_start(line):
-                    count += 1
-            all_logs[log] = count
-        return all_logs
+        def row(label, name, detail=""):
+            return "  {:<14}{:>10} MB{}".format(
+                label, format(breakdown[name], ","), detail
+            )
+
+        lines = [self._header("Memory Breakdown (from Mem-Info):")]
+        lines.append(row("Process RSS", "rss"))
+        lines.append(
+            row(
+                "Page cache",
+                "pagecache",
+                " (shmem/tmpfs {:,} MB)".format(breakdown["shmem"]),
+            )
+        )
+        lines.append(
+            row(
+                "Slab",
+                "slab",
+                " (unreclaimable {:,} MB)".format(breakdown["slab_unreclaimable"]),
+            )
+        )
+        lines.append(row("Free", "free"))
+        if breakdown["unaccounted"] < 0:
+            # RSS counts pages shared between processes once per process
+            lines.append(
+                self._warning(
+                    "  {:<14}{:>10} MB (RSS counts {:,} MB of shared pages more than once)".format(
+                        "Unaccounted", 0, -breakdown["unaccounted"]
+                    )
+                )
+            )
+        else:
+            lines.append(self._warning(row("Unaccounted", "unaccounted")))
+        lines.append(row("Page tables", "pagetables"))
+        if breakdown["swap_total"]:
+            lines.append(
+                row(
+                    "Swap used",
+                    "swap_used",
+                    " of {:,} MB".format(breakdown["swap_total"]),
+                )
+            )
+        # When processes held less than half of RAM the problem is likely elsewhere
+        if breakdown["ram"] and breakdown["rss"] * 2 < breakdown["ram"]:
+            culprit = max(
+                [
+                    ("page cache/tmpfs", breakdown["pagecache"]),
+                    ("kernel slab", breakdown["slab"]),
+                    ("unaccounted kernel memory", breakdown["unaccounted"]),
+                ],
+                key=lambda item: item[1],
+            )
+            lines.append(
+                self._critical(
+                    "Processes held only {}% of RAM, the largest other use was {}".format(
+                        breakdown["rss"] * 100 // breakdown["ram"], culprit[0]
+                    )
+                )
+            )
+        return lines
 
     def print_pretty_oom_instance(self, oom_instance):
         """Method to print the OOM incident in a pretty format"""
@@ -647,11 +2482,20 @@ class OOMAnalyzer(Printer):
             + self._critical(str(format(oom_instance["total_mb"], ",")) + " MB")
         )
 
+        lines.extend(self.print_pretty_memory_breakdown(oom_instance))
+        lines.extend(self.print_pretty_allocation(oom_instance))
+        lines.extend(self.print_pretty_numa(oom_instance))
+        lines.extend(self.print_pretty_context(oom_instance))
+
         lines.append(self._warning("The following processes were killed:"))
         for killed in oom_instance["killed"]:
             lines.append("  " + self._critical(killed))
 
         sorted_result, count = self.sorted_results(oom_instance["processes"])
+        if not sorted_result:
+            lines.append(self._warning("No process table was logged for this incident"))
+            lines.append("")
+            return lines
 
         # Calculate column widths dynamically
         process_width = max(len(process) for process, _ in sorted_result) + 2
@@ -682,59 +2526,1425 @@ class OOMAnalyzer(Printer):
                 rss=format(rss, ",") + " MB",
                 rss_width=rss_width,
             )
-            lines.append("  " + self._notice(data_row.rstrip()))
+            lines.append("  " + self._notice(data_row.rstrip()))
+
+        lines.extend(self.print_pretty_rollup(oom_instance))
+        lines.extend(self.print_pretty_candidates(oom_instance))
+        lines.append("")
+        return lines
+
+    def print_pretty_allocation(self, oom_instance):
+        """The failed allocation, its zones' free lists and whether it was fragmentation"""
+        allocation = oom_instance.get("allocation")
+        if not allocation:
+            return []
+        order = allocation["order"]
+        lines = [self._header("Failed Allocation:")]
+        lines.append(
+            "  Order {}{}, gfp_mask={} ({})".format(
+                order,
+                " ({} kB)".format(4 << order) if order >= 0 else "",
+                allocation["gfp_mask"],
+                "|".join(allocation["gfp_flags"]) or "none",
+            )
+        )
+        free_blocks = allocation["free_blocks"]
+        if free_blocks:
+            width = max(len(zone) for zone in free_blocks) + 2
+        for zone in sorted(free_blocks):
+            counts = free_blocks[zone]
+            sizes = [size for size, count in enumerate(counts) if count]
+            lines.append(
+                "  "
+                + self._notice(
+                    "{:<{width}}{:>12} kB free, largest block {}".format(
+                        zone,
+                        format(
+                            sum(
+                                count * (4 << size) for size, count in enumerate(counts)
+                            ),
+                            ",",
+                        ),
+                        "{:,} kB".format(4 << sizes[-1]) if sizes else "none",
+                        width=width,
+                    )
+                )
+            )
+        failure = self.allocation_failure(oom_instance)
+        if failure == "fragmentation":
+            lines.append(
+                self._critical(
+                    "Fragmentation: memory was above the min watermark but no block of "
+                    "{:,} kB or larger was free, more RAM won't help".format(4 << order)
+                )
+            )
+        elif failure == "exhaustion":
+            lines.append(
+                self._warning(
+                    "Exhaustion: memory had run out{}".format(
+                        ", not fragmented" if order > 0 else ""
+                    )
+                )
+            )
+        return lines
+
+    def print_pretty_numa(self, oom_instance):
+        """Each zone's free memory against its watermarks, and any node-local exhaustion"""
+        exhaustion = self.numa_exhaustion(oom_instance)
+        if exhaustion is None:
+            return []
+        numa = oom_instance["numa"]
+        zones = numa["zones"]
+        width = max(len(zone) for zone in zones) + 2
+        lines = [self._header("Zones (kB):")]
+        lines.append(
+            self._header(
+                "  {:<{width}}{:>12}{:>12}{:>12}{:>12}".format(
+                    "ZONE", "FREE", "MIN", "LOW", "HIGH", width=width
+                )
+            )
+        )
+        for zone in sorted(zones, key=lambda zone: (int(zone.split()[1]), zone)):
+            free, _, low, _ = zones[zone]
+            row = "  {:<{width}}{:>12}{:>12}{:>12}{:>12}".format(
+                zone, *[format(kb, ",") for kb in zones[zone]], width=width
+            )
+            lines.append(self._warning(row) if free <= low else self._notice(row))
+        lines.append(
+            "  cpuset={} mems_allowed={}{}".format(
+                numa["cpuset"] or "?",
+                numa["mems_allowed"] or "?",
+                " constraint=" + numa["constraint"] if numa["constraint"] else "",
+            )
+        )
+        if exhaustion["exhausted"] and exhaustion["spare"]:
+            lines.append(
+                self._critical(
+                    "Node-local exhaustion: node {} was below its low watermark while node {} "
+                    "had {:,} kB free, fix NUMA placement rather than adding RAM".format(
+                        ",".join(str(node) for node in exhaustion["exhausted"]),
+                        ",".join(str(node) for node in exhaustion["spare"]),
+                        sum(
+                            exhaustion["nodes"][node][0] for node in exhaustion["spare"]
+                        ),
+                    )
+                )
+            )
+        if exhaustion["constrained"]:
+            lines.append(
+                self._critical(
+                    "Constrained OOM: only node(s) {} were allowed by the {}".format(
+                        numa["mems_allowed"] or "?",
+                        (
+                            "memory policy"
+                            if numa["constraint"] == "CONSTRAINT_MEMORY_POLICY"
+                            else "cpuset " + (numa["cpuset"] or "?")
+                        ),
+                    )
+                )
+            )
+        return lines
+
+    def print_pretty_context(self, oom_instance):
+        """The non-kernel log lines leading up to the incident, with --context"""
+        context = oom_instance.get("context")
+        if context is None:
+            return []
+        if not context:
+            return [
+                self._warning("No non-kernel log lines since the previous incident")
+            ]
+        lines = [self._header("Log lines before the incident:")]
+        lines.extend("  " + self._notice(line) for line in context)
+        return lines
+
+    def print_pretty_rollup(self, oom_instance):
+        """The incident's memory by --group-by uid, cgroup or name, largest first"""
+        if not oom_instance.get("rollups"):
+            return []
+        rollup = oom_instance["rollups"][self.group_by]
+        if not rollup:
+            return [
+                self._warning(
+                    "No {} was logged for this incident".format(self.group_by)
+                )
+            ]
+        total = oom_instance["total_mb"] or 1
+        rows = sorted(rollup.items(), key=lambda item: (-item[1], item[0]))
+        width = max(len(str(key)) for key, _ in rows[:10]) + 2
+        lines = [self._header("Memory by {} (top 10):".format(self.group_by))]
+        for key, mb in rows[:10]:
+            lines.append(
+                "  "
+                + self._notice(
+                    "{:<{width}}{:>10}  {:>3}%".format(
+                        key, format(mb, ",") + " MB", mb * 100 // total, width=width
+                    )
+                )
+            )
+        return lines
+
+    def print_pretty_candidates(self, oom_instance):
+        """Why the victim was chosen, and who would go next with other oom_score_adj values"""
+        candidates = oom_instance.get("candidates")
+        if not candidates:
+            return []
+        total_pages = oom_instance["total_pages"] or 1
+        killed = set(oom_instance["killed_pids"])
+
+        def rows(ranked):
+            for rank, candidate in enumerate(ranked, 1):
+                row = "  {:<6}{:<10}{:<7}{:<7}{}".format(
+                    rank,
+                    candidate["pid"],
+                    # The same scale as /proc/<pid>/oom_score
+                    max(0, candidate["badness"] * 1000 // total_pages),
+                    candidate["adj"],
+                    candidate["name"],
+                )
+                if candidate["pid"] in killed:
+                    yield self._critical(row + "  <- killed")
+                else:
+                    yield self._notice(row)
+
+        lines = [
+            self._header("Kill Candidates (oom badness recomputed from the table):")
+        ]
+        lines.append(self._header("  RANK  PID       SCORE  ADJ    NAME"))
+        lines.extend(rows(candidates))
+        if killed and candidates[0]["pid"] not in killed:
+            lines.append(
+                self._warning(
+                    "The process killed wasn't the top candidate: a child may have been "
+                    "killed in place of its parent, or this was a cgroup OOM"
+                )
+            )
+
+        simulated = oom_instance.get("simulated")
+        if simulated is not None:
+            overrides = ", ".join(
+                "{}={}".format(name, adj)
+                for name, adj in sorted(self.adj_overrides.items())
+            )
+            lines.append(self._header("With oom_score_adj " + overrides + ":"))
+            if not simulated:
+                lines.append(self._ok("  No process would have been eligible to kill"))
+            else:
+                lines.append(
+                    "  The kernel would have killed "
+                    + self._critical(simulated[0]["name"])
+                    + " (pid {})".format(simulated[0]["pid"])
+                )
+                lines.extend(rows(simulated[:5]))
+        return lines
+
+    @property
+    def log_is_empty(self):
+        return not self.log_start_time and not self.log_end_time
+
+    def merged_source_names(self):
+        return [log_file or source for source, log_file in self.system.merge_sources]
+
+    def print_pretty_log_info(self):
+        """Method to print the OOM incident in a pretty format"""
+        source = self.get_log_source()
+
+        lines = []
+        if source == "journalctl":
+            lines.append(self._header("Using Journalctl: ") + self._ok("True"))
+        elif source == "dmesg":
+            lines.append(self._header("Using Dmesg: ") + self._ok("True"))
+        elif source == "merged":
+            lines.append(
+                self._header("Merged Sources: ")
+                + self._ok(", ".join(self.merged_source_names()))
+            )
+            lines.append(
+                self._header("Duplicate Lines Merged: ")
+                + self._notice(str(self.merged_duplicates))
+            )
+        else:
+            lines.append(self._header("Using Log File: ") + self._ok(self.log_file))
+        if self.rotated_files:
+            lines.append(self._header("Rotated Logs Read (oldest first):"))
+            for log_file in self.rotated_files:
+                lines.append("  " + self._notice(log_file))
+            if self.merged_duplicates:
+                lines.append(
+                    self._header("Lines Repeated Across Rotations Skipped: ")
+                    + self._notice(str(self.merged_duplicates))
+                )
+        if self.archive_members:
+            lines.append(self._header("Logs Read From Archive:"))
+            for member in self.archive_members:
+                lines.append("  " + self._notice(member))
+
+        # Exit early if log file is empty
+        if self.log_is_empty:
+            lines.append("")
+            lines.append(self._warning("Log file appears to be empty"))
+            lines.append("")
+            return lines
+
+        for label, timestamp in (
+            ("Log Start Time: ", self.log_start_time),
+            ("Log End Time: ", self.log_end_time),
+        ):
+            lines.append(
+                self._header(label)
+                + (
+                    self._notice(timestamp.strftime("%a %b %d %X"))
+                    if timestamp
+                    else self._critical("Unable to extract datetime")
+                )
+            )
+        if self.truncated:
+            lines.append(
+                self._critical(
+                    "Analysis stopped early: analyzer memory use passed {} MB".format(
+                        self.max_rss
+                    )
+                )
+            )
+        if self.duplicates:
+            lines.append(
+                self._header("Duplicate Incidents Skipped: ")
+                + self._notice(str(self.duplicates))
+            )
+        lines.append("")
+        return lines
+
+
+class IncidentStore(Printer):
+    """
+    SQLite store of parsed incidents so history can be queried across runs
+
+    Incidents are keyed by host and fingerprint, so storing the same log (or overlapping
+    logs) again is a no-op.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS incidents (
+            id INTEGER PRIMARY KEY,
+            host TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            start_time TEXT,
+            invoked_by TEXT,
+            system_ram_mb INTEGER,
+            total_mb INTEGER,
+            UNIQUE (host, fingerprint)
+        );
+        CREATE INDEX IF NOT EXISTS incidents_start_time ON incidents (start_time);
+        CREATE TABLE IF NOT EXISTS processes (
+            incident_id INTEGER NOT NULL REFERENCES incidents (id),
+            pid INTEGER,
+            name TEXT,
+            rss_mb INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS processes_incident ON processes (incident_id);
+        CREATE INDEX IF NOT EXISTS processes_name ON processes (name);
+        CREATE TABLE IF NOT EXISTS killed (
+            incident_id INTEGER NOT NULL REFERENCES incidents (id),
+            pid INTEGER,
+            name TEXT
+        );
+        CREATE INDEX IF NOT EXISTS killed_incident ON killed (incident_id);
+        CREATE INDEX IF NOT EXISTS killed_name ON killed (name);
+    """
+
+    # name: (description, query, column headers). Every query takes a single "since" bound.
+    REPORTS = {
+        "kills": (
+            "Kills per service",
+            "SELECT k.name, COUNT(*) AS kills, MIN(i.start_time), MAX(i.start_time) "
+            "FROM killed k JOIN incidents i ON i.id = k.incident_id "
+            "WHERE i.start_time >= ? GROUP BY k.name ORDER BY kills DESC",
+            ("SERVICE", "KILLS", "FIRST KILL", "LAST KILL"),
+        ),
+        "kill-log": (
+            "Every kill",
+            "SELECT i.start_time, i.host, k.name, k.pid, i.total_mb "
+            "FROM killed k JOIN incidents i ON i.id = k.incident_id "
+            "WHERE i.start_time >= ? ORDER BY i.start_time",
+            ("TIME", "HOST", "SERVICE", "PID", "TOTAL RSS (MB)"),
+        ),
+        "largest-weekly": (
+            "Largest incident per host and week",
+            # SQLite returns the other columns from the row holding the MAX()
+            "SELECT strftime('%Y-%W', start_time) AS week, host, MAX(total_mb), start_time "
+            "FROM incidents WHERE start_time >= ? GROUP BY week, host ORDER BY week, host",
+            ("WEEK", "HOST", "TOTAL RSS (MB)", "TIME"),
+        ),
+        "hosts": (
+            "Incidents per host",
+            "SELECT host, COUNT(*), MAX(total_mb), MIN(start_time), MAX(start_time) "
+            "FROM incidents WHERE start_time >= ? GROUP BY host ORDER BY COUNT(*) DESC",
+            ("HOST", "INCIDENTS", "LARGEST (MB)", "FIRST", "LAST"),
+        ),
+    }
+
+    def __init__(self, path, default_host=None, reference_time=None):
+        if sqlite3 is None:
+            raise RuntimeError(
+                "The sqlite3 module is not available in this Python build"
+            )
+        self.path = path
+        self.default_host = default_host or "unknown"
+        # Syslog timestamps have no year, so they are stored relative to this time
+        self.reference_time = reference_time or datetime.datetime.now()
+        self.added = 0
+        self.connection = sqlite3.connect(path)
+        # Python 2 reads lines as UTF-8 str, which sqlite3 only accepts with this
+        self.connection.text_factory = str
+        self.connection.executescript(self.SCHEMA)
+
+    def normalise_time(self, timestamp):
+        """ISO timestamp with the year filled in for syslog times, which don't log one"""
+        if timestamp is None:
+            return None
+        return with_year(timestamp, self.reference_time).isoformat(" ")
+
+    def add(self, oom_instance):
+        """Store an incident with its process rows and kills. Returns False if already stored"""
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO incidents "
+            "(host, fingerprint, start_time, invoked_by, system_ram_mb, total_mb) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                oom_instance.get("host") or self.default_host,
+                oom_instance["fingerprint"],
+                self.normalise_time(oom_instance.get("start_time")),
+                oom_instance.get("invoked_by"),
+                int(str(oom_instance["system_ram"]).replace(",", "")),
+                oom_instance["total_mb"],
+            ),
+        )
+        if cursor.rowcount == 0:
+            return False
+        incident_id = cursor.lastrowid
+        self.connection.executemany(
+            "INSERT INTO processes (incident_id, pid, name, rss_mb) VALUES (?, ?, ?, ?)",
+            (
+                (incident_id, process.get("pid"), process["name"], process["rss"])
+                for process in oom_instance["processes"]
+            ),
+        )
+        self.connection.executemany(
+            "INSERT INTO killed (incident_id, pid, name) VALUES (?, ?, ?)",
+            (
+                (incident_id, pid, name)
+                for name, pid in zip(
+                    oom_instance["killed"], oom_instance["killed_pids"]
+                )
+            ),
+        )
+        self.added += 1
+        return True
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def query(self, report, since=None):
+        """Run one of the canned reports, returning its headers and rows"""
+        _, sql, headers = self.REPORTS[report]
+        return headers, self.connection.execute(sql, (since or "",)).fetchall()
+
+    def print_pretty_report(self, report, since=None):
+        description = self.REPORTS[report][0]
+        headers, rows = self.query(report, since)
+        lines = [self._header(description + (" since " + since if since else ""))]
+        if not rows:
+            lines.append(self._ok("No incidents stored"))
+            return lines + [""]
+        rows = [["" if value is None else str(value) for value in row] for row in rows]
+        widths = [
+            max(len(header), *[len(row[index]) for row in rows]) + 2
+            for index, header in enumerate(headers)
+        ]
+        lines.append(
+            self._header("".join(h.ljust(w) for h, w in zip(headers, widths)).rstrip())
+        )
+        for row in rows:
+            lines.append(
+                self._notice("".join(v.ljust(w) for v, w in zip(row, widths)).rstrip())
+            )
+        lines.append("")
+        return lines
+
+
+class Timeline(Printer):
+    """
+    Incidents, kills and total RSS bucketed per hour, day or week
+
+    Counters are updated as incidents stream past, so no incident is kept to build the view.
+    At most `max_buckets` buckets are kept; when more are needed the oldest is folded into a
+    single "earlier" counter.
+    """
+
+    PERIODS = {
+        "hour": (datetime.timedelta(hours=1), "%a %b %d %H:00"),
+        "day": (datetime.timedelta(days=1), "%a %b %d"),
+        "week": (datetime.timedelta(weeks=1), "w/c %a %b %d"),
+    }
+    SPARKS = " .:-=+*#%@"
+    SPARK_WIDTH = 72
+    BAR_WIDTH = 40
+
+    def __init__(self, period="day", reference_time=None, max_buckets=60):
+        self.period = period
+        self.step, self.label_format = self.PERIODS[period]
+        self.reference_time = reference_time or datetime.datetime.now()
+        self.max_buckets = max_buckets
+        # bucket start -> [incidents, kills, total RSS MB]
+        self.buckets = {}
+        self.earlier = [0, 0, 0]
+        self.undated = [0, 0, 0]
+        # Newest bucket folded into "earlier"; anything at or before it is added there too
+        self.folded_until = None
+
+    def bucket_start(self, timestamp):
+        start = with_year(timestamp, self.reference_time).replace(
+            minute=0, second=0, microsecond=0
+        )
+        if self.period != "hour":
+            start = start.replace(hour=0)
+        if self.period == "week":
+            start -= datetime.timedelta(days=start.weekday())
+        return start
+
+    def add(self, oom_instance):
+        counts = (1, len(oom_instance["killed"]), oom_instance["total_mb"])
+        timestamp = oom_instance.get("start_time")
+        if timestamp is None:
+            counter = self.undated
+        else:
+            start = self.bucket_start(timestamp)
+            if self.folded_until is not None and start <= self.folded_until:
+                counter = self.earlier
+            else:
+                counter = self.buckets.setdefault(start, [0, 0, 0])
+                if len(self.buckets) > self.max_buckets:
+                    self.fold_oldest()
+                    counter = self.buckets.get(start, self.earlier)
+        for index, value in enumerate(counts):
+            counter[index] += value
+
+    def fold_oldest(self):
+        oldest = min(self.buckets)
+        for index, value in enumerate(self.buckets.pop(oldest)):
+            self.earlier[index] += value
+        self.folded_until = oldest
+
+    def rows(self):
+        """(label, start, [incidents, kills, rss]) for every non-empty bucket, oldest first"""
+        rows = []
+        if self.earlier[0]:
+            rows.append(("earlier", None, self.earlier))
+        for start in sorted(self.buckets):
+            rows.append((start.strftime(self.label_format), start, self.buckets[start]))
+        if self.undated[0]:
+            rows.append(("undated", None, self.undated))
+        return rows
+
+    def sparkline(self):
+        """One character per period up to the last bucket, at most SPARK_WIDTH periods"""
+        if not self.buckets:
+            return ""
+        first, last = min(self.buckets), max(self.buckets)
+        first = max(first, self.bucket_start(last - self.step * (self.SPARK_WIDTH - 1)))
+        peak = max(counts[0] for counts in self.buckets.values())
+        chars = []
+        start = first
+        while start <= last:
+            incidents = self.buckets.get(start, [0])[0]
+            level = int(float(incidents) / peak * (len(self.SPARKS) - 1) + 0.5)
+            chars.append(self.SPARKS[max(level, 1) if incidents else 0])
+            start = self.bucket_start(start + self.step)
+        return "".join(chars)
+
+    def as_dict(self):
+        return {
+            "period": self.period,
+            "buckets": [
+                {
+                    "start": start.isoformat(" ") if start else label,
+                    "incidents": counts[0],
+                    "kills": counts[1],
+                    "rss_mb": counts[2],
+                }
+                for label, start, counts in self.rows()
+            ],
+        }
+
+    def print_pretty_timeline(self):
+        lines = []
+        lines.append("")
+        lines.append(self._header("      OOM Timeline (per {})".format(self.period)))
+        lines.append(self.spacer)
+        lines.append("")
+        rows = self.rows()
+        if not rows:
+            return lines
+        peak = max(counts[0] for _, _, counts in rows)
+        width = max(len(label) for label, _, _ in rows)
+        lines.append(
+            self._header(
+                "{}  {:>9}  {:>5}  {:>10}".format(
+                    "Period".ljust(width), "Incidents", "Kills", "RSS (MB)"
+                )
+            )
+        )
+        for label, _, (incidents, kills, rss) in rows:
+            bar = "#" * max(1, int(float(incidents) / peak * self.BAR_WIDTH + 0.5))
+            lines.append(
+                "{}  {:>9}  {:>5}  {:>10}  ".format(
+                    label.ljust(width), incidents, kills, "{:,}".format(rss)
+                )
+                + self._critical(bar)
+            )
+        lines.append("")
+        lines.append(
+            "Incidents per {}: ".format(self.period)
+            + self._warning("[" + self.sparkline() + "]")
+        )
+        lines.append("")
+        lines.append(self.spacer)
+        return lines
+
+
+class LeakDetector(Printer):
+    """
+    Follows each process name's total RSS across incidents and flags names whose footprint at
+    incident time rises steadily (a leak) rather than staying flat (undersized).
+
+    A least squares trend is fitted incrementally: only a handful of running sums is kept per
+    name, never the incidents themselves.
+    """
+
+    MIN_INCIDENTS = 3
+    # How well the trend must fit, and how much it must rise (as a fraction of the mean RSS)
+    MIN_R_SQUARED = 0.6
+    MIN_GROWTH = 0.1
+
+    def __init__(self, reference_time=None):
+        self.reference_time = reference_time or datetime.datetime.now()
+        self.first_time = None
+        # name -> [n, sum t, sum rss, sum t^2, sum t*rss, sum rss^2, first t, last t,
+        #          rss at first t, rss at last t, count at last t]
+        self.sums = {}
+
+    def add(self, oom_instance):
+        start_time = oom_instance.get("start_time")
+        if start_time is None:
+            return
+        start_time = with_year(start_time, self.reference_time)
+        if self.first_time is None:
+            self.first_time = start_time
+        hours = (start_time - self.first_time).total_seconds() / 3600.0
+
+        totals = defaultdict(lambda: [0, 0])
+        for process in oom_instance["processes"]:
+            totals[process["name"]][0] += process["rss"]
+            totals[process["name"]][1] += process.get("count", 1)
+
+        for name, (rss, count) in totals.items():
+            sums = self.sums.get(name)
+            if sums is None:
+                sums = self.sums[name] = [
+                    0,
+                    0.0,
+                    0,
+                    0.0,
+                    0.0,
+                    0,
+                    hours,
+                    hours,
+                    rss,
+                    rss,
+                    0,
+                ]
+            sums[0] += 1
+            sums[1] += hours
+            sums[2] += rss
+            sums[3] += hours * hours
+            sums[4] += hours * rss
+            sums[5] += rss * rss
+            if hours < sums[6]:
+                sums[6], sums[8] = hours, rss
+            if hours >= sums[7]:
+                sums[7], sums[9], sums[10] = hours, rss, count
+
+    def trend(self, name):
+        """Growth in MB per hour and how well a straight line fits, or None if unknown"""
+        n, st, sy, stt, sty, syy = self.sums[name][:6]
+        time_spread = n * stt - st * st
+        if n < 2 or time_spread <= 0:
+            return None
+        covariance = n * sty - st * sy
+        rss_spread = n * syy - sy * sy
+        r_squared = (
+            covariance * covariance / (time_spread * rss_spread) if rss_spread else 0
+        )
+        return covariance / time_spread, r_squared
+
+    def leaks(self):
+        """Names that look like they are leaking, fastest growing first"""
+        leaks = []
+        for name, sums in self.sums.items():
+            trend = None if sums[0] < self.MIN_INCIDENTS else self.trend(name)
+            if trend is None:
+                continue
+            slope, r_squared = trend
+            growth = slope * (sums[7] - sums[6])
+            if (
+                slope > 0
+                and r_squared >= self.MIN_R_SQUARED
+                and growth >= self.MIN_GROWTH * sums[2] / sums[0]
+            ):
+                leaks.append(
+                    {
+                        "name": name,
+                        "mb_per_hour": round(slope, 1),
+                        "fit": round(r_squared, 2),
+                        "incidents": sums[0],
+                        "first_rss": sums[8],
+                        "last_rss": sums[9],
+                        "last_count": sums[10],
+                    }
+                )
+        return sorted(leaks, key=lambda leak: leak["mb_per_hour"], reverse=True)
+
+    def print_pretty_leaks(self):
+        lines = []
+        lines.append("")
+        lines.append(self._header("      Possible Memory Leaks"))
+        lines.append(self.spacer)
+        lines.append("")
+        leaks = self.leaks()
+        if not leaks:
+            lines.append(
+                self._ok("No service's RSS grew steadily across the incidents found")
+            )
+        for leak in leaks:
+            lines.append(
+                "- "
+                + self._warning(leak["name"])
+                + ": "
+                + self._critical("+{:,} MB/hour".format(leak["mb_per_hour"]))
+                + " over {} incidents ({:,} MB -> {:,} MB in {} processes, fit {})".format(
+                    leak["incidents"],
+                    leak["first_rss"],
+                    leak["last_rss"],
+                    leak["last_count"],
+                    leak["fit"],
+                )
+            )
+        lines.append("")
+        lines.append(self.spacer)
+        return lines
+
+
+class StormClusterer(Printer):
+    """
+    Groups incidents less than `gap` seconds apart into storms as they stream past, so a burst
+    of OOMs can be reported once: its duration, kills, victims and peak incident.
+
+    Only the open storm's peak incident is held. Finished storms are kept as small summaries.
+    """
+
+    SHOW_STORMS = 10
+
+    def __init__(self, gap, reference_time=None):
+        self.gap = datetime.timedelta(seconds=gap)
+        self.reference_time = reference_time or datetime.datetime.now()
+        self.current = None
+        # Summaries of every finished storm of more than one incident
+        self.storms = []
+        # Storms and lone incidents found so far
+        self.events = 0
+
+    def add(self, oom_instance):
+        """Add the next incident. Returns the storm it closed, if it started a new one"""
+        time = oom_instance.get("start_time")
+        if time is not None:
+            time = with_year(time, self.reference_time)
+        closed = None
+        storm = self.current
+        if storm is not None and (
+            time is None
+            or storm["last_time"] is None
+            or abs(time - storm["last_time"]) > self.gap
+        ):
+            closed = self.close()
+        if self.current is None:
+            self.current = {
+                "first_incident": oom_instance["incident_number"],
+                "start": time,
+                "end": time,
+                "incidents": 0,
+                "kills": 0,
+                "victims": defaultdict(int),
+                "peak": oom_instance,
+            }
+        storm = self.current
+        storm["last_incident"] = oom_instance["incident_number"]
+        storm["last_time"] = time
+        if time is not None:
+            storm["start"], storm["end"] = min(storm["start"], time), max(
+                storm["end"], time
+            )
+        storm["incidents"] += 1
+        storm["kills"] += len(oom_instance["killed"])
+        for name in oom_instance["killed"]:
+            storm["victims"][name] += 1
+        if oom_instance["total_mb"] > storm["peak"]["total_mb"]:
+            storm["peak"] = oom_instance
+        return closed
+
+    def close(self):
+        storm, self.current = self.current, None
+        if storm is not None:
+            self.events += 1
+            if storm["incidents"] > 1:
+                self.storms.append(self.summary(storm))
+        return storm
+
+    def summary(self, storm):
+        start, end = storm["start"], storm["end"]
+        return {
+            "first_incident": min(storm["first_incident"], storm["last_incident"]),
+            "last_incident": max(storm["first_incident"], storm["last_incident"]),
+            "incidents": storm["incidents"],
+            "kills": storm["kills"],
+            "victims": dict(storm["victims"]),
+            "start": start and start.isoformat(" "),
+            "end": end and end.isoformat(" "),
+            "duration_seconds": int((end - start).total_seconds()) if start else None,
+            "peak_incident": storm["peak"]["incident_number"],
+            "peak_total_mb": storm["peak"]["total_mb"],
+        }
+
+    def victims_text(self, victims):
+        return ", ".join(
+            "{} ({})".format(name, count)
+            for name, count in sorted(victims.items(), key=lambda item: -item[1])
+        )
+
+    def print_pretty_storm(self, storm, analyzer):
+        """A storm's summary followed by its peak incident, or just the incident if alone"""
+        if storm["incidents"] == 1:
+            return analyzer.print_pretty_oom_instance(storm["peak"])
+        summary = self.summary(storm)
+        lines = []
+        lines.append(
+            self._critical("OOM Storm: ")
+            + self._notice(
+                "incidents {}-{}".format(
+                    summary["first_incident"], summary["last_incident"]
+                )
+            )
+            + " ({} incidents)".format(summary["incidents"])
+        )
+        if storm["start"] is not None:
+            lines.append(
+                "Duration: "
+                + self._ok(
+                    "{} - {} ({} seconds)".format(
+                        storm["start"].strftime("%b %d %X"),
+                        storm["end"].strftime("%X"),
+                        summary["duration_seconds"],
+                    )
+                )
+            )
+        lines.append(
+            "Kills: "
+            + self._critical(str(summary["kills"]))
+            + " - "
+            + self._warning(self.victims_text(summary["victims"]))
+        )
+        lines.append(self._header("Peak incident of the storm:"))
+        lines.extend(analyzer.print_pretty_oom_instance(storm["peak"]))
+        return lines
+
+    def print_pretty_storms(self):
+        lines = []
+        lines.append("")
+        lines.append(
+            self._header(
+                "      OOM Storms (incidents under {}s apart)".format(
+                    int(self.gap.total_seconds())
+                )
+            )
+        )
+        lines.append(self.spacer)
+        lines.append("")
+        if not self.storms:
+            lines.append(self._ok("No storms: every incident was on its own"))
+        storms = sorted(self.storms, key=lambda storm: -storm["incidents"])
+        for storm in storms[: self.SHOW_STORMS]:
+            lines.append(
+                "- "
+                + self._notice(
+                    "Incidents {}-{}".format(
+                        storm["first_incident"], storm["last_incident"]
+                    )
+                )
+                + ": {} incidents{}, {} kills, peak incident {} ({:,} MB)".format(
+                    storm["incidents"],
+                    (
+                        " in {} seconds".format(storm["duration_seconds"])
+                        if storm["duration_seconds"] is not None
+                        else ""
+                    ),
+                    storm["kills"],
+                    storm["peak_incident"],
+                    storm["peak_total_mb"],
+                )
+            )
+        if len(storms) > self.SHOW_STORMS:
+            lines.append("  ... and {} more".format(len(storms) - self.SHOW_STORMS))
+        lines.append("")
+        lines.append(self.spacer)
+        return lines
+
+
+class LogFollower(object):
+    """
+    Complete lines appended to a log file since the last read. A rotated or truncated log is
+    followed to the new file, which is read from its start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.inode = None
+        # The end of the last read, up to a newline not written yet
+        self.partial = b""
+        self.open(from_start=False)
+
+    def open(self, from_start=True):
+        try:
+            # io.open rather than open: Python 2's file objects stay at EOF once they reach it
+            self.file = io.open(self.path, "rb")
+        except (IOError, OSError):
+            self.file = None
+            return
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        if not from_start:
+            self.file.seek(0, os.SEEK_END)
+
+    def read_new(self):
+        if self.file is None:
+            self.open()
+            if self.file is None:
+                return []
+        data = self.partial + self.file.read()
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            stat = None
+        if stat is not None and (
+            stat.st_ino != self.inode or stat.st_size < self.file.tell()
+        ):
+            self.file.close()
+            self.open()
+            if self.file is not None:
+                data += self.file.read()
+        lines = data.split(b"\n")
+        self.partial = lines.pop()
+        return [line + b"\n" for line in lines]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class PressureMonitor(Printer):
+    """
+    --live: samples memory pressure (PSI), MemAvailable and a cgroup's memory.events counters
+    into a ring buffer of the last `history` samples. When a kill is seen, in the followed
+    log or as a rise in the oom_kill counter, the buffer is snapshotted so the pressure
+    leading up to it can be shown. A sample reads three small files, so it can be left running.
+    """
+
+    HISTORY = 120
+    EVENTS = ("oom", "oom_kill", "high", "max")
+    # (sample key, label, unit) of each curve shown for a kill
+    CURVES = (
+        ("some", "PSI some avg10", "%"),
+        ("full", "PSI full avg10", "%"),
+        ("available_mb", "MemAvailable", " MB"),
+    )
+
+    def __init__(self, proc_dir="/proc", cgroup_dir=None, history=HISTORY):
+        self.psi_path = os.path.join(proc_dir, "pressure", "memory")
+        self.meminfo_path = os.path.join(proc_dir, "meminfo")
+        self.events_path = cgroup_dir and os.path.join(cgroup_dir, "memory.events")
+        self.samples = deque(maxlen=history)
+        self.invoked_by = None
+
+    def read(self, path):
+        # Missing on kernels without PSI, or without cgroup v2
+        if not path:
+            return ""
+        try:
+            with open(path) as f:
+                return f.read()
+        except (IOError, OSError):
+            return ""
+
+    def sample(self, now=None):
+        sample = {"time": now or datetime.datetime.now()}
+        for line in self.read(self.psi_path).splitlines():
+            fields = line.split()
+            if fields and fields[0] in ("some", "full"):
+                for field in fields[1:]:
+                    key, _, value = field.partition("=")
+                    if key == "avg10":
+                        sample[fields[0]] = float(value)
+        for line in self.read(self.meminfo_path).splitlines():
+            if line.startswith("MemAvailable:"):
+                sample["available_mb"] = int(line.split()[1]) // 1024
+                break
+        for line in self.read(self.events_path).splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[0] in self.EVENTS:
+                sample[fields[0]] = int(fields[1])
+        self.samples.append(sample)
+        return sample
+
+    def poll(self, analyzer, lines=(), now=None):
+        """
+        Take a sample and check the lines appended to the log since the last poll. Returns
+        a list of kill events, each with a snapshot of the samples leading up to it.
+        """
+        previous = self.samples[-1] if self.samples else None
+        sample = self.sample(now)
+        killed = []
+        for raw in lines:
+            if not OOM_MARKERS.search(raw):
+                continue
+            line = decode_line(raw)
+            self.invoked_by = analyzer.parse_invoked_by(line) or self.invoked_by
+            if analyzer.is_killed_process(line):
+                killed.append(analyzer.parse_killed_process_line(line))
+        # Kills in the cgroup that weren't logged where we are looking still count
+        oom_kills = 0
+        if previous is not None and "oom_kill" in sample and "oom_kill" in previous:
+            oom_kills = sample["oom_kill"] - previous["oom_kill"]
+        if not killed and oom_kills <= 0:
+            return []
+        event = {
+            "time": sample["time"],
+            "killed": killed,
+            "invoked_by": self.invoked_by,
+            "oom_kills": max(oom_kills, 0),
+            "samples": list(self.samples),
+        }
+        self.invoked_by = None
+        return [event]
+
+    def curve(self, values):
+        """A sparkline of values, one character per sample"""
+        known = [value for value in values if value is not None]
+        peak = max(known) if known else 0
+        chars = []
+        for value in values:
+            if value is None:
+                chars.append("?")
+            elif not peak:
+                chars.append(Timeline.SPARKS[0])
+            else:
+                level = int(float(value) / peak * (len(Timeline.SPARKS) - 1) + 0.5)
+                chars.append(Timeline.SPARKS[max(level, 1) if value else 0])
+        return "".join(chars)
+
+    def print_pretty_event(self, event):
+        samples = event["samples"]
+        lines = [""]
+        lines.append(
+            self._critical("OOM kill")
+            + " seen at "
+            + event["time"].strftime("%a %b %d %X")
+        )
+        if event["invoked_by"]:
+            lines.append("Invoked by: " + self._warning(event["invoked_by"]))
+        for killed in event["killed"]:
+            lines.append("Killed: " + self._critical(killed))
+        if event["oom_kills"]:
+            lines.append(
+                "memory.events oom_kill: "
+                + self._critical("+{}".format(event["oom_kills"]))
+            )
+
+        span = (samples[-1]["time"] - samples[0]["time"]).total_seconds()
+        lines.append(
+            self._header(
+                "Memory pressure over the {:.0f} seconds before the kill:".format(span)
+            )
+        )
+        for key, label, unit in self.CURVES:
+            values = [sample.get(key) for sample in samples]
+            known = [value for value in values if value is not None]
+            if not known:
+                continue
+            worst = min(known) if key == "available_mb" else max(known)
+            lines.append(
+                "  {:<15}{}  {}".format(
+                    label,
+                    self._notice(self.curve(values)),
+                    "min" if key == "available_mb" else "max",
+                )
+                + " "
+                + self._warning("{:,}{}".format(worst, unit))
+            )
+        first, last = samples[0], samples[-1]
+        counters = [
+            "{} +{}".format(name, last[name] - first[name])
+            for name in self.EVENTS
+            if name in first and name in last
+        ]
+        if counters:
+            lines.append("  memory.events  " + ", ".join(counters))
+        return lines
+
+
+def write_live(system, analyzer, options, renderer):
+    """
+    --live: sample memory pressure every --interval seconds and, as kills appear in the log
+    (or in the cgroup's oom_kill counter), show the pressure that led up to each one
+    """
+    monitor = PressureMonitor(options.proc_dir, options.cgroup_dir)
+    follower = None
+    if analyzer.get_log_source() == "file" and not is_archive(analyzer.log_file):
+        follower = LogFollower(analyzer.log_file)
+    renderer.write(
+        [
+            system._header("Watching for OOM kills")
+            + " (every {}s, Ctrl-C to stop)".format(options.interval),
+            "Log: " + (analyzer.log_file if follower else "none, memory.events only"),
+        ]
+    )
+    try:
+        while True:
+            lines = follower.read_new() if follower else []
+            for event in monitor.poll(analyzer, lines):
+                renderer.write(monitor.print_pretty_event(event))
+                # Shown as it happens, even when piped
+                renderer.stream.flush()
+            time.sleep(options.interval)
+    finally:
+        if follower:
+            follower.close()
+
+
+def incident_overview_lines(
+    system, total_incidents, killed_services, largest_incident, recent_only=False
+):
+    """Summary of every incident seen: counts, killed services and the largest incident"""
+    lines = []
+    lines.append(system.spacer)
+    lines.append("")
+    lines.append("")
+    lines.append(
+        system._critical(
+            "WARNING: This device has run out of memory at least once in this log file."
+        )
+    )
+    lines.append("")
+    lines.append(system.spacer)
+    lines.append("")
+    lines.append(system._header("      Incident Overview"))
+    lines.append(system.spacer)
+    lines.append("")
+    lines.append(
+        system._header("OOM Incidents: ") + system._critical(str(total_incidents))
+    )
+    if recent_only:
+        lines.append(
+            system._notice(
+                "Only the most recent incidents were read (the log was read backwards). "
+                "Use -a to analyze every incident."
+            )
+        )
+        lines.append("Killed Services across the incidents read: ")
+    else:
+        lines.append("Killed Services across all incidents: ")
+    sorted_killed_service_count = sorted(
+        killed_services.items(), key=lambda x: x[1], reverse=True
+    )
+    for service, count in sorted_killed_service_count:
+        lines.append(
+            "- "
+            + system._warning(service)
+            + ": killed "
+            + system._critical(str(count))
+            + " times"
+        )
+    lines.append("")
+    lines.append(
+        "Highest OOM Incident: "
+        + system._warning("Incident Number " + str(largest_incident["incident_number"]))
+    )
+    lines.append(
+        "Available RAM: " + system._warning(str(largest_incident["system_ram"]) + " MB")
+    )
+    lines.append(
+        "Memory Used In Incident: "
+        + system._critical(str(largest_incident["total_mb"]) + " MB")
+    )
+    lines.append("")
+    lines.append(system.spacer)
+    return lines
+
+
+def incidents_header_lines(system, show_counter, storm_gap=None):
+    lines = []
+    lines.append("")
+    lines.append(system._header("         OOM Incidents"))
+    lines.append(system.spacer)
+    lines.append("")
+    show = "all" if show_counter == -1 else show_counter
+    if storm_gap:
+        lines.append(
+            "Displaying {} OOM incidents (incidents under {}s apart are shown as one "
+            "storm):".format(show, storm_gap)
+        )
+    else:
+        lines.append("Displaying {} OOM incidents:".format(show))
+    lines.append("")
+    return lines
+
+
+def host_overview_lines(system, hosts):
+    """Incidents, kills and the largest incident of each host, for logs holding several"""
+    lines = []
+    lines.append("")
+    lines.append(system._header("      Incidents by Host"))
+    lines.append(system.spacer)
+    lines.append("")
+    width = max(len(str(host)) for host in hosts) + 2
+    lines.append(
+        system._header(
+            "  {:<{width}}{:>10}{:>8}{:>14}".format(
+                "HOST", "INCIDENTS", "KILLS", "LARGEST", width=width
+            )
+        )
+    )
+    for host, counts in sorted(hosts.items(), key=lambda item: (-item[1][0], item[0])):
+        lines.append(
+            "  "
+            + system._notice(
+                "{:<{width}}{:>10}{:>8}{:>14}".format(
+                    host,
+                    counts[0],
+                    counts[1],
+                    format(counts[2], ",") + " MB",
+                    width=width,
+                )
+            )
+        )
+    lines.append("Use --host to report on a single host")
+    return lines
 
-        lines.append("")
-        return lines
 
-    def print_pretty_log_info(self):
-        """Method to print the OOM incident in a pretty format"""
-        source = self.get_log_source()
+def log_reference_time(analyzer):
+    """The time year-less syslog lines are dated against: the log file's age, or now"""
+    if analyzer.get_log_source() == "file":
+        return datetime.datetime.fromtimestamp(os.path.getmtime(analyzer.log_file))
+    return datetime.datetime.now()
 
-        lines = []
-        if source == "journalctl":
-            lines.append(self._header("Using Journalctl: ") + self._ok("True"))
-        elif source == "dmesg":
-            lines.append(self._header("Using Dmesg: ") + self._ok("True"))
-        else:
-            lines.append(self._header("Using Log File: ") + self._ok(self.log_file))
 
-        # Exit early if log file is empty
-        if not self.log_start_time and not self.log_end_time:
-            lines.append("")
-            lines.append(self._warning("Log file appears to be empty"))
-            lines.append("")
-            print("\n".join(lines))
-            sys.exit(0)
+def open_incident_store(analyzer, path):
+    """Open the SQLite store, using the log file's age to date year-less syslog lines"""
+    # dmesg has no hostname field, so it can only be this machine
+    default_host = (
+        socket.gethostname() if analyzer.get_log_source() == "dmesg" else None
+    )
+    return IncidentStore(
+        path, default_host=default_host, reference_time=log_reference_time(analyzer)
+    )
+
+
+def print_store_report(options):
+    """Answer one of the canned questions from the incident store without reading any logs"""
+    if not options.db or not os.path.isfile(options.db):
+        print("Error: --report needs an existing incident store, given with --db")
+        return sys.exit(1)
+    store = IncidentStore(options.db)
+    renderer = Renderer()
+    renderer.write(store.print_pretty_report(options.report, options.since))
+    renderer.close()
+    store.close()
+    return sys.exit(0)
+
+
+def with_defaults(options):
+    """Fill in any option the caller didn't provide (e.g. when run() is used directly)"""
+    defaults = get_parser().get_default_values()
+    for key, value in vars(options).items():
+        setattr(defaults, key, value)
+    return defaults
+
+
+def run(system, options, renderer=None):
+    """Analyze the log source and write the report out as it is produced"""
+    options = with_defaults(options)
+    renderer = renderer or Renderer()
+    try:
+        write_report(system, options, renderer)
+    finally:
+        renderer.close()
 
+    return sys.exit(0)
+
+
+def json_lines(data):
+    # Explicit separators keep Python 2 from leaving trailing spaces after commas
+    return [json.dumps(data, indent=2, sort_keys=True, separators=(",", ": "))]
+
+
+def json_summary(
+    analyzer, total_incidents, killed_services, largest_incident, timeline
+):
+    """Machine readable overview, built from the same running totals as the text report"""
+    summary = {
+        "log": (
+            analyzer.merged_source_names()
+            if analyzer.get_log_source() == "merged"
+            else analyzer.log_file or analyzer.get_log_source()
+        ),
+        "incidents": total_incidents,
+        "duplicates": analyzer.duplicates,
+        "truncated": analyzer.truncated,
+        "killed_services": dict(killed_services),
+        "largest_incident": None,
+    }
+    if largest_incident is not None:
+        start_time = largest_incident.get("start_time")
+        if start_time is not None:
+            start_time = with_year(start_time, log_reference_time(analyzer))
+        summary["largest_incident"] = {
+            "incident_number": largest_incident["incident_number"],
+            "fingerprint": largest_incident["fingerprint"],
+            "start_time": start_time and start_time.isoformat(" "),
+            "system_ram_mb": int(str(largest_incident["system_ram"]).replace(",", "")),
+            "total_mb": largest_incident["total_mb"],
+            "killed": largest_incident["killed"],
+            "memory_mb": analyzer.memory_breakdown(largest_incident),
+        }
+        if largest_incident.get("allocation"):
+            summary["largest_incident"]["allocation"] = dict(
+                largest_incident["allocation"],
+                failure=analyzer.allocation_failure(largest_incident),
+            )
+        exhaustion = analyzer.numa_exhaustion(largest_incident)
+        if exhaustion is not None:
+            summary["largest_incident"]["numa"] = dict(
+                largest_incident["numa"],
+                exhausted_nodes=exhaustion["exhausted"],
+                spare_nodes=exhaustion["spare"],
+                constrained=exhaustion["constrained"],
+            )
+        for key in ("candidates", "rollups", "context"):
+            if largest_incident.get(key):
+                summary["largest_incident"][key] = largest_incident[key]
+    if timeline is not None:
+        summary["timeline"] = timeline.as_dict()
+    return summary
+
+
+def write_incident(system, analyzer, options, renderer):
+    """
+    --incident N: show a single incident. With an offset index for the log only that
+    incident's lines are read; otherwise the log is scanned once, which writes the index.
+    """
+    number = options.incident
+    oom_instance = None
+    offsets = analyzer.load_index()
+    if offsets is None:
+        for incident in analyzer.analyze():
+            if incident["incident_number"] == number:
+                oom_instance = incident
+        offsets = analyzer.incident_offsets if analyzer.index_path() else {}
+
+    lines = [system.spacer, ""]
+    if options.raw and number in offsets:
+        start, end = offsets[number]
         lines.append(
-            self._header("Log Start Time: ")
-            + self._notice(self.log_start_time.strftime("%a %b %d %X"))
+            system._header("Incident {}: ".format(number))
+            + "bytes {}-{} of {}".format(start, end, analyzer.log_file)
         )
+        lines.append("")
+        lines.extend(decode_line(raw) for raw in analyzer.read_block(start, end))
+        lines.append("")
+        renderer.write(lines)
+        return
+    if options.raw and oom_instance is not None:
         lines.append(
-            self._header("Log End Time: ")
-            + self._notice(self.log_end_time.strftime("%a %b %d %X"))
+            system._warning(
+                "The original lines can only be shown from an uncompressed log file"
+            )
         )
         lines.append("")
-        return lines
+        renderer.write(lines)
+        return
+
+    if oom_instance is None and number in offsets:
+        incidents = list(analyzer.analyze(lines=analyzer.read_block(*offsets[number])))
+        if incidents:
+            oom_instance = incidents[0]
+            oom_instance["incident_number"] = number
+    if oom_instance is None:
+        lines.append(
+            system._warning(
+                "Incident {} not found, the log has {} OOM incidents".format(
+                    number, len(offsets) or analyzer.oom_counter
+                )
+            )
+        )
+    else:
+        lines.extend(analyzer.print_pretty_oom_instance(oom_instance))
+    lines.append("")
+    renderer.write(lines)
 
 
-def run(system, options):
+def write_report(system, options, renderer):
     reverse, quick = options.reverse, options.quick
 
     # Account for --all flag
     show_counter = -1 if options.show_all else options.show_counter
 
     # Parse the log file and extract OOM incidents
-    analyzer = OOMAnalyzer(system)
+    analyzer = OOMAnalyzer(
+        system,
+        budget=options.budget,
+        max_rss=options.max_rss,
+        explain=options.explain,
+        adj_overrides=parse_adj_overrides(options.adj),
+        group_by=options.group_by,
+        context=options.context,
+        only_host=options.host,
+        gentle=options.gentle,
+    )
 
     # Print system and log overview
-    system.print_pretty()
+    if not options.json:
+        system.print_pretty(renderer)
+
+    if options.incident:
+        return write_incident(system, analyzer, options, renderer)
+    if options.live:
+        return write_live(system, analyzer, options, renderer)
 
     lines = []
     # Quick check
     if quick:
         all_results = analyzer.quick_check()
+        if options.json:
+            renderer.write(json_lines({"quick_check": all_results}))
+            return
         lines.append(system.spacer)
         lines.append("")
         lines.append(system._warning("Performing a quick check..."))
@@ -747,56 +3957,134 @@ def run(system, options):
         lines.append("")
         lines.append(system.spacer)
         lines.append("")
-        print("\n".join(lines))
+        renderer.write(lines)
+        return
 
-        return sys.exit(0)
+    timeline = (
+        Timeline(options.timeline, reference_time=log_reference_time(analyzer))
+        if options.timeline
+        else None
+    )
+    leaks = (
+        LeakDetector(reference_time=log_reference_time(analyzer))
+        if options.leaks
+        else None
+    )
+    storms = (
+        StormClusterer(options.storm_gap, reference_time=log_reference_time(analyzer))
+        if options.storm_gap
+        else None
+    )
+    # --all shows every incident on its own; otherwise each storm is shown once
+    collapse_storms = storms is not None and not options.show_all
 
     # Find the largest incident
     largest_incident = None
-    oom_instances = analyzer.analyze()
+    # The most recent incidents can be read from the end of the log when the report doesn't
+    # need every incident
+    recent_only = (
+        reverse
+        and show_counter != -1
+        and not options.json
+        and not (options.db or timeline or leaks or options.context or options.host)
+        and analyzer.can_read_backwards()
+    )
+    if recent_only:
+        oom_instances = iter(
+            analyzer.analyze_recent(
+                show_counter, options.storm_gap if collapse_storms else None
+            )
+        )
+    else:
+        oom_instances = analyzer.analyze()
 
     # Exit early if no OOM incidents were found
     try:
         first_item = next(oom_instances)
     except (StopIteration, TypeError):
+        if options.json:
+            summary = json_summary(analyzer, 0, {}, None, timeline)
+            renderer.write(json_lines(summary))
+            return
+        lines.extend(analyzer.print_pretty_log_info())
+        if analyzer.log_is_empty:
+            renderer.write(lines)
+            return
         source = analyzer.get_log_source()
         if source == "journalctl":
             msg = "No OOM incidents found! Journalctl has no OOM incidents."
         elif source == "dmesg":
             msg = "No OOM incidents found! Dmesg has no OOM incidents."
+        elif source == "merged":
+            msg = "No OOM incidents found! {} have no OOM incidents.".format(
+                ", ".join(analyzer.merged_source_names())
+            )
         else:
             msg = (
                 "No OOM incidents found! "
                 + analyzer.log_file
                 + " has no OOM incidents."
             )
-        lines.extend(analyzer.print_pretty_log_info())
         lines.append(system._ok(msg))
         lines.append("")
-        print("\n".join(lines))
-        return sys.exit(0)
+        renderer.write(lines)
+        return
 
     # Add the first item back to the iterator
     oom_instances = itertools.chain([first_item], oom_instances)
 
     # Handle the reverse flag and obtain the last incident
-    if reverse:
+    if reverse and not options.json and not recent_only:
         oom_instances = iter(reversed(list(oom_instances)))
 
-    last_incident = None
-    sliced_oom_instance_numbers = []
+    # When every incident is shown in log order, write each one as soon as it is parsed and
+    # follow them with the overview. Time to first output and memory use then no longer
+    # depend on the number of incidents in the log.
+    streaming = show_counter == -1 and not reverse and not options.json
+    if streaming:
+        renderer.write(incidents_header_lines(system, show_counter))
+
+    store = open_incident_store(analyzer, options.db) if options.db else None
+
+    sliced_oom_instance_numbers = set()
     oom_lines = []
 
+    def show_storm(storm):
+        # storms.events already counts this storm
+        if (
+            storm
+            and not options.json
+            and (show_counter == -1 or storms.events <= show_counter)
+        ):
+            sliced_oom_instance_numbers.add(storm["peak"]["incident_number"])
+            oom_lines.extend(storms.print_pretty_storm(storm, analyzer))
+
     killed_services_count = defaultdict(int)
+    # host -> [incidents, kills, largest incident MB]
+    hosts = defaultdict(lambda: [0, 0, 0])
     for index, oom_instance in enumerate(oom_instances or []):
-        # If reverse is set, we need to get the last incident, which is actually the first incident
-        if reverse and last_incident is None:
-            last_incident = oom_instance
-        elif not reverse:
-            last_incident = oom_instance
-
-        if show_counter == -1 or index < show_counter:
-            sliced_oom_instance_numbers.append(oom_instance["incident_number"])
+        host_counts = hosts[oom_instance["host"] or "unknown"]
+        host_counts[0] += 1
+        host_counts[1] += len(oom_instance["killed"])
+        host_counts[2] = max(host_counts[2], oom_instance["total_mb"])
+        if store:
+            store.add(oom_instance)
+        if timeline:
+            timeline.add(oom_instance)
+        if leaks:
+            leaks.add(oom_instance)
+        if storms:
+            closed = storms.add(oom_instance)
+            if collapse_storms:
+                show_storm(closed)
+        if streaming:
+            renderer.write(analyzer.print_pretty_oom_instance(oom_instance))
+        elif (
+            not collapse_storms
+            and not options.json
+            and (show_counter == -1 or index < show_counter)
+        ):
+            sliced_oom_instance_numbers.add(oom_instance["incident_number"])
             oom_lines.extend(analyzer.print_pretty_oom_instance(oom_instance))
         # Find the largest incident
         if (
@@ -808,54 +4096,87 @@ def run(system, options):
         for killed_service in oom_instance["killed"]:
             killed_services_count[killed_service] += 1
 
-    sorted_killed_service_count = sorted(
-        killed_services_count.items(), key=lambda x: x[1], reverse=True
-    )
+    if storms:
+        closed = storms.close()
+        if collapse_storms:
+            show_storm(closed)
+
+    # Incidents are numbered in log order, so the counter is the total even when reversed
+    total_incidents = analyzer.oom_counter
 
-    total_incidents = last_incident["incident_number"]
+    if store:
+        store.close()
+        if not options.json:
+            lines.append(
+                system._header("Incident Store: ")
+                + system._ok(options.db)
+                + " ({} new incidents saved)".format(store.added)
+            )
+            lines.append("")
+
+    if options.json:
+        summary = json_summary(
+            analyzer, total_incidents, killed_services_count, largest_incident, timeline
+        )
+        if leaks:
+            summary["leaks"] = leaks.leaks()
+        if storms:
+            summary["storms"] = storms.storms
+        if len(hosts) > 1:
+            summary["hosts"] = dict(
+                (
+                    host,
+                    {
+                        "incidents": counts[0],
+                        "kills": counts[1],
+                        "largest_mb": counts[2],
+                    },
+                )
+                for host, counts in hosts.items()
+            )
+        renderer.write(json_lines(summary))
+        return
+
+    if streaming:
+        lines.append(system.spacer)
+        lines.append("")
+        lines.extend(analyzer.print_pretty_log_info())
+        lines.extend(
+            incident_overview_lines(
+                system, total_incidents, killed_services_count, largest_incident
+            )
+        )
+        if timeline:
+            lines.extend(timeline.print_pretty_timeline())
+        if leaks:
+            lines.extend(leaks.print_pretty_leaks())
+        if storms:
+            lines.extend(storms.print_pretty_storms())
+        if len(hosts) > 1:
+            lines.extend(host_overview_lines(system, hosts))
+        lines.append("")
+        renderer.write(lines)
+        return
 
     # OOM Overview
     lines.extend(analyzer.print_pretty_log_info())
-    lines.append(system.spacer)
-    lines.append("")
-    lines.append("")
-    lines.append(
-        system._critical(
-            "WARNING: This device has run out of memory at least once in this log file."
-        )
-    )
-    lines.append("")
-    lines.append(system.spacer)
-    lines.append("")
-    lines.append(system._header("      Incident Overview"))
-    lines.append(system.spacer)
-    lines.append("")
-    lines.append(
-        system._header("OOM Incidents: ") + system._critical(str(total_incidents))
-    )
-    lines.append("Killed Services across all incidents: ")
-    for service, count in sorted_killed_service_count:
-        lines.append(
-            "- "
-            + system._warning(service)
-            + ": killed "
-            + system._critical(str(count))
-            + " times"
+    lines.extend(
+        incident_overview_lines(
+            system,
+            total_incidents,
+            killed_services_count,
+            largest_incident,
+            recent_only=recent_only,
         )
-    lines.append("")
-    lines.append(
-        "Highest OOM Incident: "
-        + system._warning("Incident Number " + str(largest_incident["incident_number"]))
-    )
-    lines.append(
-        "Available RAM: " + system._warning(str(largest_incident["system_ram"]) + " MB")
-    )
-    lines.append(
-        "Memory Used In Incident: "
-        + system._critical(str(largest_incident["total_mb"]) + " MB")
     )
-    lines.append("")
-    lines.append(system.spacer)
+    if timeline:
+        lines.extend(timeline.print_pretty_timeline())
+    if leaks:
+        lines.extend(leaks.print_pretty_leaks())
+    if storms:
+        lines.extend(storms.print_pretty_storms())
+    if len(hosts) > 1:
+        lines.extend(host_overview_lines(system, hosts))
 
     # Lets ALWAYS display the largest OOM incident. If it is not in the show_instances list,
     # display it.
@@ -871,13 +4192,11 @@ def run(system, options):
         lines.extend(analyzer.print_pretty_oom_instance(largest_incident))
         lines.append(system.spacer)
 
-    lines.append("")
-    lines.append(system._header("         OOM Incidents"))
-    lines.append(system.spacer)
-    lines.append("")
-    show = "all" if show_counter == -1 else show_counter
-    lines.append("Displaying {} OOM incidents:".format(show))
-    lines.append("")
+    lines.extend(
+        incidents_header_lines(
+            system, show_counter, options.storm_gap if collapse_storms else None
+        )
+    )
 
     # Display OOM incidents based on the show_counter and reverse (if provided)
     lines.extend(oom_lines)
@@ -885,7 +4204,8 @@ def run(system, options):
     lines.append("")
 
     # Only display this message if there are more oom incidents than the show_counter
-    if total_incidents > show_counter and show_counter != -1:
+    shown = storms.events if collapse_storms else total_incidents
+    if shown > show_counter and show_counter != -1:
         lines.append("")
         lines.append(
             system._warning(
@@ -895,9 +4215,7 @@ def run(system, options):
         lines.append("")
 
     lines.append("")
-    print("\n".join(lines))
-
-    return sys.exit(0)
+    renderer.write(lines)
 
 
 def validate_options(system, options):
@@ -905,6 +4223,33 @@ def validate_options(system, options):
     valid_options = [options.file, options.journalctl, options.dmesg]
     active_options = [opt for opt in valid_options if opt]
 
+    if getattr(options, "group_rules", None):
+        try:
+            system.service_groups = ServiceGroups.from_file(options.group_rules)
+        except (IOError, OSError, ValueError) as error:
+            print("Error: Unable to read the grouping rules: {}".format(error))
+            sys.exit(1)
+
+    try:
+        parse_adj_overrides(getattr(options, "adj", None))
+    except ValueError as error:
+        print("Error: {}".format(error))
+        sys.exit(1)
+
+    if getattr(options, "context", 0) < 0:
+        print("Error: --context must be 0 or more lines")
+        sys.exit(1)
+
+    if getattr(options, "live", False) and options.interval <= 0:
+        print("Error: --interval must be more than 0 seconds")
+        sys.exit(1)
+
+    if getattr(options, "gentle", False):
+        options.max_rss = options.max_rss or OOMAnalyzer.GENTLE_MAX_RSS
+
+    if getattr(options, "merge", False):
+        return validate_merge_options(system, options)
+
     # Ensure only one logging option is specified
     if len(active_options) > 1:
         print(
@@ -926,6 +4271,8 @@ def validate_options(system, options):
             sys.exit(1)
         system.log_to_use = options.file
 
+    system.read_rotated = getattr(options, "rotated", False)
+
     if not active_options:
         if not system.log_files:
             print(
@@ -938,7 +4285,56 @@ def validate_options(system, options):
     return system
 
 
-def main():
+def parse_node_list(nodes):
+    """The set of NUMA nodes in a list such as mems_allowed=0-1,3, or None if not logged"""
+    if not nodes:
+        return None
+    allowed = set()
+    for part in nodes.split(","):
+        first, _, last = part.partition("-")
+        allowed.update(range(int(first), int(last or first) + 1))
+    return allowed
+
+
+def parse_adj_overrides(values):
+    """{name: oom_score_adj} from --adj NAME=VALUE options, raising ValueError if invalid"""
+    overrides = {}
+    for value in values or []:
+        name, _, adj = value.rpartition("=")
+        if not name or not adj.lstrip("-").isdigit() or not -1000 <= int(adj) <= 1000:
+            raise ValueError(
+                "--adj {} should be NAME=VALUE, with VALUE from -1000 to 1000".format(
+                    value
+                )
+            )
+        overrides[name] = int(adj)
+    return overrides
+
+
+def validate_merge_options(system, options):
+    """--merge: read every log source given (at least two) together"""
+    if options.file and not os.path.isfile(options.file):
+        print("File {} does not exist".format(options.file))
+        sys.exit(1)
+    sources = []
+    if options.file:
+        sources.append(("file", options.file))
+        system.log_to_use = options.file
+    if options.journalctl:
+        sources.append(("journalctl", None))
+    if options.dmesg:
+        sources.append(("dmesg", None))
+    if len(sources) < 2:
+        print(
+            "Error: --merge needs at least two log sources; a log file, dmesg and/or "
+            "journalctl."
+        )
+        sys.exit(1)
+    system.merge_sources = sources
+    return system
+
+
+def get_parser():
     parser = OptionParser(usage="usage: %prog [option]")
     parser.add_option(
         "-f",
@@ -994,6 +4390,23 @@ def main():
         action="store_true",
         help="Investigate possible oom instances in the dmesg log file. ",
     )
+    parser.add_option(
+        "-m",
+        "--merge",
+        dest="merge",
+        default=False,
+        action="store_true",
+        help="Read the given log file, journalctl and/or dmesg together, merged by time with "
+        "lines found in more than one of them only read once",
+    )
+    parser.add_option(
+        "--rotated",
+        dest="rotated",
+        default=False,
+        action="store_true",
+        help="Read the log file together with all of its rotations (messages.1, "
+        "messages-20240101.gz, ...) as one log, in time order",
+    )
     parser.add_option(
         "-q",
         "--quick",
@@ -1002,6 +4415,207 @@ def main():
         action="store_true",
         help="Display the scripts version number",
     )
+    parser.add_option(
+        "-p",
+        "--pager",
+        dest="pager",
+        default=False,
+        action="store_true",
+        help="Page the report through $PAGER (default: less -R) when writing to a terminal",
+    )
+    parser.add_option(
+        "--colour",
+        "--color",
+        dest="colour",
+        default="auto",
+        type="choice",
+        choices=["auto", "always", "never"],
+        help="Colour the output: auto (only when writing to a terminal), always or never. "
+        "Default: auto",
+    )
+    parser.add_option(
+        "--budget",
+        dest="budget",
+        default=None,
+        type=int,
+        metavar="N",
+        help="Bounded memory mode for hosts with huge process tables: aggregate rows by name "
+        "while parsing and keep only the N largest names per incident",
+    )
+    parser.add_option(
+        "--gentle",
+        dest="gentle",
+        default=False,
+        action="store_true",
+        help="Go easy on a box under memory pressure: lowest CPU and I/O priority, read "
+        "the log without filling the page cache, pause while memory pressure is high and "
+        "stop at --max-rss (default {} MB)".format(OOMAnalyzer.GENTLE_MAX_RSS),
+    )
+    parser.add_option(
+        "--max-rss",
+        dest="max_rss",
+        default=None,
+        type=int,
+        metavar="MB",
+        help="Stop parsing and report what was found so far if this script's own memory use "
+        "passes MB",
+    )
+    parser.add_option(
+        "--db",
+        dest="db",
+        default=None,
+        type="string",
+        metavar="DB",
+        help="Save every incident found to this SQLite file. Incidents already stored are "
+        "skipped, so overlapping logs can be saved repeatedly.",
+    )
+    parser.add_option(
+        "--report",
+        dest="report",
+        default=None,
+        type="choice",
+        choices=sorted(IncidentStore.REPORTS),
+        help="Print a report from the --db incident store instead of reading a log: "
+        + ", ".join(sorted(IncidentStore.REPORTS)),
+    )
+    parser.add_option(
+        "--since",
+        dest="since",
+        default=None,
+        type="string",
+        metavar="YYYY-MM-DD",
+        help="Only include incidents from this date onwards in --report",
+    )
+    parser.add_option(
+        "--group-rules",
+        dest="group_rules",
+        default=None,
+        type="string",
+        metavar="FILE",
+        help="Roll process names up into services using the glob, prefix and regex rules in "
+        "FILE, so totals and kill counts are reported per service",
+    )
+    parser.add_option(
+        "--incident",
+        dest="incident",
+        default=None,
+        type=int,
+        metavar="N",
+        help="Show only incident N. Uncompressed logs are indexed on the first run, so later "
+        "lookups read just that incident",
+    )
+    parser.add_option(
+        "--raw",
+        dest="raw",
+        default=False,
+        action="store_true",
+        help="With --incident, show the incident's original log lines",
+    )
+    parser.add_option(
+        "--storm-gap",
+        dest="storm_gap",
+        default=60,
+        type=int,
+        metavar="SECONDS",
+        help="Incidents less than SECONDS apart form a storm, which is shown once with its "
+        "kills and peak incident (unless -a is given). 0 turns storms off. Default: 60",
+    )
+    parser.add_option(
+        "--host",
+        dest="host",
+        default=None,
+        metavar="HOSTNAME",
+        help="Only report on this host's incidents, for a central syslog file holding "
+        "several hosts",
+    )
+    parser.add_option(
+        "--context",
+        dest="context",
+        default=0,
+        type="int",
+        metavar="N",
+        help="Show the last N non-kernel log lines before each incident",
+    )
+    parser.add_option(
+        "--group-by",
+        dest="group_by",
+        default=None,
+        choices=["uid", "cgroup", "name"],
+        help="Show each incident's memory rolled up by uid, cgroup or process name. "
+        "--json includes all three",
+    )
+    parser.add_option(
+        "--live",
+        dest="live",
+        default=False,
+        action="store_true",
+        help="Keep running, sampling memory pressure, and show the pressure leading up to "
+        "each new OOM kill",
+    )
+    parser.add_option(
+        "--interval",
+        dest="interval",
+        default=5,
+        type="float",
+        metavar="SECONDS",
+        help="How often --live samples memory pressure. Default: 5",
+    )
+    parser.add_option(
+        "--proc-dir",
+        dest="proc_dir",
+        default="/proc",
+        metavar="DIR",
+        help="Where --live reads pressure/memory and meminfo from. Default: /proc",
+    )
+    parser.add_option(
+        "--cgroup-dir",
+        dest="cgroup_dir",
+        default="/sys/fs/cgroup/system.slice",
+        metavar="DIR",
+        help="The cgroup v2 directory whose memory.events --live samples. "
+        "Default: /sys/fs/cgroup/system.slice",
+    )
+    parser.add_option(
+        "--explain",
+        dest="explain",
+        default=False,
+        action="store_true",
+        help="Rank each incident's kill candidates by recomputing the kernel's badness score "
+        "from the process table",
+    )
+    parser.add_option(
+        "--adj",
+        dest="adj",
+        default=[],
+        action="append",
+        metavar="NAME=VALUE",
+        help="With --explain, also show who the kernel would have killed had NAME's "
+        "oom_score_adj been VALUE (e.g. mysqld=-1000). Can be given more than once",
+    )
+    parser.add_option(
+        "--timeline",
+        dest="timeline",
+        default=None,
+        type="choice",
+        choices=sorted(Timeline.PERIODS),
+        help="Add a timeline of incidents, kills and total RSS per hour, day or week to the "
+        "overview",
+    )
+    parser.add_option(
+        "--leaks",
+        dest="leaks",
+        default=False,
+        action="store_true",
+        help="Flag services whose RSS at incident time grows steadily from one incident to "
+        "the next, with an estimated growth rate",
+    )
+    parser.add_option(
+        "--json",
+        dest="json",
+        default=False,
+        action="store_true",
+        help="Write a machine readable JSON summary instead of the report",
+    )
     parser.add_option(
         "-V",
         "--version",
@@ -1009,23 +4623,42 @@ def main():
         action="store_true",
         help="Display the scripts version number",
     )
+    return parser
 
-    (options, _) = parser.parse_args()
+
+def main():
+    parser = get_parser()
+    options, _ = parser.parse_args()
 
     # Show the version number and exit
     if options.version:
         print("OOM Analyzer Version: {}".format(__version__))
         return sys.exit(0)
 
+    Printer.set_colour(
+        options.colour == "always" or (options.colour == "auto" and sys.stdout.isatty())
+    )
+
+    if options.report:
+        return print_store_report(options)
+
     system = System()
 
     # Validate the options provided by the user and the log file
     system = validate_options(system, options)
 
+    if options.gentle:
+        lower_priority()
+
+    renderer = Renderer(
+        pager=(os.environ.get("PAGER") or "less -R") if options.pager else None
+    )
+
     # Print the script header
-    main_header()
+    if not options.json:
+        main_header(renderer)
 
-    return run(system, options)
+    return run(system, options, renderer)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the path so we can import the latest version of the script
+oom_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, oom_dir)
+
+from oom_investigate import OOMAnalyzer
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir_factory, monkeypatch):
+    """Keep the log summaries each run caches out of the real ~/.cache"""
+    path = str(tmpdir_factory.mktemp("cache"))
+    monkeypatch.setattr(OOMAnalyzer, "INDEX_DIR", path)
+    return path
@@ -0,0 +1,1061 @@
+import datetime
+import gzip
+import io
+import os
+import re
+import sys
+import tarfile
+import time
+
+import pytest
+
+# Add the parent directory to the path so we can import the latest version of the script
+oom_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, oom_dir)
+
+from oom_investigate import (
+    LeakDetector,
+    LogFollower,
+    OOMAnalyzer,
+    PressureMonitor,
+    ServiceGroups,
+    StormClusterer,
+    System,
+    Timeline,
+    TopK,
+    decode_line,
+    iter_reversed_lines,
+    line_time_key,
+    merge_by_time,
+)
+
+# Ignore DeprecationWarning and PendingDeprecationWarning warnings
+pytest.mark.filterwarnings("ignore::DeprecationWarning")
+pytest.mark.filterwarnings("ignore::PendingDeprecationWarning")
+
+SINGLE_INCIDENT_LOG = "tests/assets/logs/messages.1"
+
+
+def read_asset(path):
+    with open(path) as f:
+        return f.read()
+
+
+def make_sosreport(path):
+    """Build a small sosreport-like archive holding the same incident twice"""
+    with open(SINGLE_INCIDENT_LOG, "rb") as f:
+        content = f.read()
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as gz:
+        gz.write(content)
+    members = [
+        ("sosreport-host/var/log/messages", content),
+        ("sosreport-host/var/log/messages-20240930.gz", buf.getvalue()),
+        ("sosreport-host/var/log/secure", content),
+        ("sosreport-host/etc/hosts", b"127.0.0.1 localhost\n"),
+    ]
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+class TestAnalyzer:
+    system = System()
+
+    def get_analyzer(self, log_file, **kwargs):
+        self.system.log_to_use = log_file
+        return OOMAnalyzer(self.system, **kwargs)
+
+    def test_incident_identity(self):
+        analyzer = self.get_analyzer(SINGLE_INCIDENT_LOG)
+        incidents = list(analyzer.analyze())
+
+        assert len(incidents) == 1
+        assert incidents[0]["invoked_by"] == "in:imjournal"
+        assert incidents[0]["killed"] == ["cache-main"]
+        assert incidents[0]["killed_pids"] == [3117813]
+        assert len(incidents[0]["fingerprint"]) == 16
+
+    def test_duplicate_incidents_in_one_file(self, tmpdir):
+        # Simulate a copytruncate overlap where the same OOM is logged twice
+        log_file = tmpdir.join("messages")
+        log_file.write("\n".join([read_asset(SINGLE_INCIDENT_LOG)] * 2))
+
+        analyzer = self.get_analyzer(str(log_file))
+        incidents = list(analyzer.analyze())
+
+        assert len(incidents) == 1
+        assert incidents[0]["incident_number"] == 1
+        assert analyzer.duplicates == 1
+
+    def test_duplicate_incidents_across_sources(self):
+        analyzer = self.get_analyzer(SINGLE_INCIDENT_LOG)
+        first = list(analyzer.analyze())
+        second = list(analyzer.analyze(log_file=SINGLE_INCIDENT_LOG))
+
+        assert len(first) == 1
+        assert second == []
+        assert analyzer.oom_counter == 1
+
+    def test_invalid_bytes_do_not_break_parsing(self, tmpdir):
+        with open(SINGLE_INCIDENT_LOG, "rb") as f:
+            content = f.read()
+        # Binary junk before the incident and a process name that isn't valid UTF-8
+        content = b"\n\xff\xfe\x00 binary junk\n" + content.replace(
+            b"tuned", b"tun\xe9d"
+        )
+        log_file = tmpdir.join("messages")
+        log_file.write_binary(content)
+
+        analyzer = self.get_analyzer(str(log_file))
+        incidents = list(analyzer.analyze())
+
+        assert len(incidents) == 1
+        assert incidents[0]["total_mb"] == 5249
+        assert decode_line(b"tun\xe9d") in [
+            process["name"] for process in incidents[0]["processes"]
+        ]
+        # The name is hashed into the fingerprint and formatted into the report
+        assert incidents[0]["fingerprint"]
+        report = "\n".join(analyzer.print_pretty_oom_instance(incidents[0]))
+        assert decode_line(b"tun\xe9d") in report
+        # The start time comes from the first line that has one
+        assert analyzer.log_start_time.strftime("%b %d %X") == "Sep 29 08:12:34"
+
+    def test_archive_logs_read_without_extracting(self, tmpdir):
+        archive = str(tmpdir.join("sosreport-host.tar.gz"))
+        make_sosreport(archive)
+
+        analyzer = self.get_analyzer(archive)
+        incidents = list(analyzer.analyze())
+
+        # Both copies of the incident are read, the rotated copy is deduplicated
+        assert len(incidents) == 1
+        assert analyzer.duplicates == 1
+        assert analyzer.archive_members == [
+            "sosreport-host/var/log/messages",
+            "sosreport-host/var/log/messages-20240930.gz",
+        ]
+
+    def test_archive_quick_check(self, tmpdir):
+        archive = str(tmpdir.join("sosreport-host.tar.gz"))
+        make_sosreport(archive)
+
+        assert self.get_analyzer(archive).quick_check() == {
+            "sosreport-host/var/log/messages": 1,
+            "sosreport-host/var/log/messages-20240930.gz": 1,
+        }
+
+    def test_budget_mode_keeps_totals(self):
+        full = list(self.get_analyzer(SINGLE_INCIDENT_LOG).analyze())[0]
+        budget = list(self.get_analyzer(SINGLE_INCIDENT_LOG, budget=5).analyze())[0]
+
+        # Totals are exact, only the per-name breakdown is bounded
+        assert budget["total_mb"] == full["total_mb"]
+        assert budget["fingerprint"] == full["fingerprint"]
+        assert len(budget["processes"]) == 5
+        sorted_result, count = self.get_analyzer(SINGLE_INCIDENT_LOG).sorted_results(
+            budget["processes"]
+        )
+        assert sorted_result[0][0] == "cache-main"
+        assert sorted_result[0][1] >= 4745
+        assert count["cache-main"] == 1
+
+    def test_table_closed_without_killed_line(self, tmpdir):
+        lines = [
+            line
+            for line in read_asset(SINGLE_INCIDENT_LOG).splitlines()
+            if "Killed process" not in line
+        ]
+        lines += ["Sep 29 08:12:35 hnsin-varnish cron: job started"] * 250
+        # Looks like a process row but belongs to something else entirely
+        lines.append(
+            "Sep 29 08:12:36 hnsin-varnish kernel: [ 999]  0  999  9999  999999  0  0 bogus"
+        )
+        log_file = tmpdir.join("messages")
+        log_file.write("\n".join(lines))
+
+        incident = list(self.get_analyzer(str(log_file)).analyze())[0]
+        assert incident["killed"] == []
+        assert "bogus" not in [process["name"] for process in incident["processes"]]
+        assert incident["total_mb"] == 5249
+
+    def test_meminfo_breakdown(self):
+        analyzer = self.get_analyzer(SINGLE_INCIDENT_LOG)
+        incident = list(analyzer.analyze())[0]
+
+        # Counters joined onto one line with #012 are all picked up, per node kB values aren't
+        assert incident["meminfo"]["slab_unreclaimable"] == 13399 * 4
+        assert incident["meminfo"]["free"] == 23902 * 4
+        assert incident["meminfo"]["ram"] == 1572729 * 4
+        breakdown = analyzer.memory_breakdown(incident)
+        assert breakdown["rss"] == 5249
+        assert breakdown["pagecache"] == 371
+        assert breakdown["slab"] == 95
+        # 6,143 MB of RAM less RSS, page cache, slab and free
+        assert breakdown["unaccounted"] == 334
+
+    def test_meminfo_on_separate_lines(self):
+        analyzer = self.get_analyzer("tests/assets/logs/messages")
+        incident = next(analyzer.analyze())
+
+        assert incident["meminfo"]["active_anon"] == 7343961 * 4
+        assert incident["meminfo"]["shmem"] == 52281 * 4
+        assert incident["meminfo"]["swap_total"] == 2097148
+        # Shared pages are counted once per process, so RSS can exceed RAM
+        assert analyzer.memory_breakdown(incident)["unaccounted"] < 0
+
+    def test_merged_sources(self, tmpdir):
+        # The same incident as journalctl would print it, plus a line syslog doesn't have
+        journal = [
+            line.replace("Sep 29 08:12:34", "2024-09-29T08:12:34+0000", 1)
+            for line in read_asset(SINGLE_INCIDENT_LOG).splitlines()
+        ]
+        journal.insert(
+            0, "2024-09-29T08:12:30+0000 hnsin-varnish kernel: only in journal"
+        )
+        journal_file = tmpdir.join("journal")
+        journal_file.write("\n".join(journal) + "\n")
+
+        self.system.merge_sources = [
+            ("file", SINGLE_INCIDENT_LOG),
+            ("file", str(journal_file)),
+        ]
+        try:
+            analyzer = self.get_analyzer(SINGLE_INCIDENT_LOG)
+            incidents = list(analyzer.analyze())
+            lines = [decode_line(raw) for raw in analyzer.log_lines("merged")]
+        finally:
+            self.system.merge_sources = []
+
+        assert analyzer.get_log_source() == "merged"
+        # Every kernel line was in both sources and is only parsed once
+        assert len(incidents) == 1
+        assert analyzer.duplicates == 0
+        assert incidents[0]["total_mb"] == 5249
+        assert len(lines) == len(journal)
+        assert lines[0].endswith("only in journal")
+
+    def test_rotated_logs_read_in_time_order(self, tmpdir):
+        lines = read_asset(SINGLE_INCIDENT_LOG).splitlines(True)
+        # The incident is split by a copytruncate rotation that repeated a few lines
+        older = tmpdir.join("messages-20240929")
+        older.write("".join(lines[:40]))
+        newer = tmpdir.join("messages")
+        newer.write(
+            "".join(
+                lines[35:40]
+                + [line.replace("08:12:34", "08:12:35") for line in lines[40:]]
+            )
+        )
+        sept_29 = time.mktime((2024, 9, 29, 8, 12, 34, 0, 0, -1))
+        os.utime(str(older), (sept_29, sept_29))
+        os.utime(str(newer), (sept_29 + 60, sept_29 + 60))
+
+        self.system.read_rotated = True
+        try:
+            analyzer = self.get_analyzer(str(newer))
+            incidents = list(analyzer.analyze())
+        finally:
+            self.system.read_rotated = False
+
+        assert analyzer.get_log_source() == "rotated"
+        assert analyzer.rotated_files == [str(older), str(newer)]
+        assert analyzer.merged_duplicates == 5
+        assert len(incidents) == 1
+        assert incidents[0]["total_mb"] == 5249
+        assert incidents[0]["killed"] == ["cache-main"]
+
+    def test_service_groups_applied_while_parsing(self):
+        ungrouped = list(self.get_analyzer(SINGLE_INCIDENT_LOG).analyze())[0]
+        self.system.service_groups = ServiceGroups(
+            [("prefix", "systemd", "systemd"), ("glob", "cache-*", "varnish")]
+        )
+        try:
+            incident = list(self.get_analyzer(SINGLE_INCIDENT_LOG).analyze())[0]
+        finally:
+            self.system.service_groups = None
+
+        names = set(process["name"] for process in incident["processes"])
+        assert "systemd" in names
+        assert not [name for name in names if name.startswith("systemd-")]
+        assert incident["killed"] == ["varnish"]
+        assert incident["total_mb"] == ungrouped["total_mb"]
+        # Grouping doesn't change an incident's identity
+        assert incident["fingerprint"] == ungrouped["fingerprint"]
+
+    def test_incident_offset_index(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(OOMAnalyzer, "INDEX_DIR", str(tmpdir))
+        log_file = "tests/assets/logs/messages"
+        incidents = list(self.get_analyzer(log_file).analyze())
+
+        analyzer = self.get_analyzer(log_file)
+        offsets = analyzer.load_index()
+        assert sorted(offsets) == list(range(1, 20))
+
+        block = analyzer.read_block(*offsets[17])
+        assert b"invoked oom-killer" in block[0]
+        assert b"Killed process" in block[-1]
+        # Parsing just the block gives the same incident as the full scan
+        incident = list(analyzer.analyze(lines=block))[0]
+        assert incident["fingerprint"] == incidents[16]["fingerprint"]
+        assert incident["total_mb"] == incidents[16]["total_mb"]
+        assert incident["system_ram"] == incidents[16]["system_ram"]
+
+    def test_kill_candidates(self):
+        incident = list(self.get_analyzer(SINGLE_INCIDENT_LOG, explain=True).analyze())[
+            0
+        ]
+
+        candidates = incident["candidates"]
+        assert len(candidates) == OOMAnalyzer.CANDIDATES
+        assert candidates[0]["pid"] in incident["killed_pids"]
+        assert candidates[0]["name"] == "cache-main"
+        scores = [candidate["badness"] for candidate in candidates]
+        assert scores == sorted(scores, reverse=True)
+        assert incident["simulated"] is None
+
+    def test_simulated_oom_score_adj(self):
+        analyzer = self.get_analyzer(
+            SINGLE_INCIDENT_LOG, adj_overrides={"cache-main": -1000, "dnf": 1000}
+        )
+        incident = list(analyzer.analyze())[0]
+
+        simulated = incident["simulated"]
+        # -1000 is never killed, and 1000 puts a process ahead of everything else
+        assert "cache-main" not in [candidate["name"] for candidate in simulated]
+        assert simulated[0]["name"] == "dnf"
+        assert simulated[0]["adj"] == 1000
+        # The real ranking is unchanged
+        assert incident["candidates"][0]["name"] == "cache-main"
+
+    def test_rollups(self):
+        analyzer = self.get_analyzer(SINGLE_INCIDENT_LOG, group_by="uid")
+        incident = list(analyzer.analyze())[0]
+
+        rollups = incident["rollups"]
+        assert sorted(rollups) == ["cgroup", "name", "uid"]
+        # Every dimension accounts for the whole table
+        for rollup in rollups.values():
+            assert sum(rollup.values()) == incident["total_mb"]
+        assert rollups["uid"]["991"] == 4745
+        assert rollups["name"]["cache-main"] == 4745
+        # Only the victim's cgroup is logged in a global OOM
+        assert rollups["cgroup"] == {
+            "/system.slice/varnish.service": 4745,
+            OOMAnalyzer.UNATTRIBUTED_CGROUP: incident["total_mb"] - 4745,
+        }
+
+    def test_no_rollups_by_default(self):
+        incident = list(self.get_analyzer(SINGLE_INCIDENT_LOG).analyze())[0]
+        assert incident["rollups"] is None
+
+    def test_context_lines(self, tmpdir):
+        log_file = tmpdir.join("messages")
+        log_file.write(
+            "Sep 29 08:10:00 hnsin-varnish CROND[1]: (root) CMD (backup.sh)\n"
+            "Sep 29 08:11:00 hnsin-varnish deploy: release 42 started\n"
+            "Sep 29 08:12:00 hnsin-varnish kernel: eth0: link up\n"
+            "Sep 29 08:12:30 hnsin-varnish varnishd[2]: "
+            + "x" * 1000
+            + "\n"
+            + read_asset(SINGLE_INCIDENT_LOG)
+        )
+        incident = list(self.get_analyzer(str(log_file), context=2).analyze())[0]
+
+        # Only the last N non-kernel lines are kept, each cut to a bounded length
+        assert len(incident["context"]) == 2
+        assert incident["context"][0].endswith("release 42 started")
+        assert len(incident["context"][1]) == OOMAnalyzer.CONTEXT_LINE_BYTES
+
+        incident = list(self.get_analyzer(str(log_file)).analyze())[0]
+        assert incident["context"] is None
+
+    def test_failed_allocation(self):
+        incident = list(self.get_analyzer(SINGLE_INCIDENT_LOG).analyze())[0]
+        allocation = incident["allocation"]
+        assert allocation["order"] == 0
+        assert allocation["gfp_flags"] == ["GFP_HIGHUSER_MOVABLE"]
+        assert sorted(allocation["free_blocks"]) == [
+            "Node 0 DMA",
+            "Node 0 DMA32",
+            "Node 0 Normal",
+        ]
+        assert allocation["free_blocks"]["Node 0 Normal"][:3] == [635, 480, 310]
+        assert len(allocation["free_blocks"]["Node 0 Normal"]) == 11
+        assert (
+            self.get_analyzer(SINGLE_INCIDENT_LOG).allocation_failure(incident)
+            == "exhaustion"
+        )
+
+        # Older kernels log the mask without the flag names
+        incident = list(self.get_analyzer("tests/assets/logs/messages").analyze())[0]
+        assert incident["allocation"]["gfp_mask"] == "0x280da"
+        assert incident["allocation"]["gfp_flags"] == [
+            "__GFP_HIGHMEM",
+            "__GFP_MOVABLE",
+            "__GFP_WAIT",
+            "__GFP_IO",
+            "__GFP_FS",
+            "__GFP_ZERO",
+            "__GFP_HARDWALL",
+        ]
+
+    def test_fragmentation(self, tmpdir):
+        log = read_asset(SINGLE_INCIDENT_LOG).replace("order=0", "order=3")
+        log_file = tmpdir.join("messages")
+        log_file.write(log)
+        analyzer = self.get_analyzer(str(log_file))
+        incident = list(analyzer.analyze())[0]
+        # DMA32 and Normal had free blocks of order 3 (32 kB) and larger
+        assert analyzer.allocation_failure(incident) == "exhaustion"
+
+        # The DMA zone's 2048 and 4096 kB blocks are kept and don't count
+        for size in ("32", "64", "128", "256", "512", "1024"):
+            log = re.sub(
+                r"\d+\*{}kB( \(\w+\))?".format(size), "0*{}kB".format(size), log
+            )
+        log_file.write(log)
+        analyzer = self.get_analyzer(str(log_file))
+        incident = list(analyzer.analyze())[0]
+        assert analyzer.allocation_failure(incident) == "fragmentation"
+        report = "\n".join(analyzer.print_pretty_oom_instance(incident))
+        assert "no block of 32 kB or larger was free" in report
+
+        # Below the min watermark it ran out of memory, fragmented or not
+        for zone_free in ("free:43760kB", "free:37372kB"):
+            log = log.replace(zone_free, "free:30000kB")
+        log_file.write(log)
+        analyzer = self.get_analyzer(str(log_file))
+        incident = list(analyzer.analyze())[0]
+        assert analyzer.allocation_failure(incident) == "exhaustion"
+
+    def test_numa_zones(self):
+        analyzer = self.get_analyzer(SINGLE_INCIDENT_LOG)
+        incident = list(analyzer.analyze())[0]
+        numa = incident["numa"]
+        assert numa["zones"]["Node 0 DMA32"] == [43760, 31812, 39764, 47716]
+        assert len(numa["zones"]) == 3
+        assert (numa["cpuset"], numa["mems_allowed"]) == ("/", "0")
+        assert numa["constraint"] == "CONSTRAINT_NONE"
+        # Its Normal zone was below the low watermark, but there was no other node
+        exhaustion = analyzer.numa_exhaustion(incident)
+        assert (exhaustion["exhausted"], exhaustion["spare"]) == ([0], [])
+        assert not exhaustion["constrained"]
+        report = "\n".join(analyzer.print_pretty_oom_instance(incident))
+        assert "Node-local" not in report
+
+        # Older kernels log the cpuset on its own line before the dump
+        incident = list(self.get_analyzer("tests/assets/logs/messages").analyze())[0]
+        assert (incident["numa"]["cpuset"], incident["numa"]["mems_allowed"]) == (
+            "/",
+            "0",
+        )
+        assert incident["numa"]["zones"]["Node 0 Normal"][:2] == [60780, 60824]
+
+        # A single node can't be short of memory while another one has plenty
+        analyzer = self.get_analyzer("tests/assets/logs/messages")
+        for incident in analyzer.analyze():
+            assert analyzer.numa_exhaustion(incident)["spare"] == []
+            report = "\n".join(analyzer.print_pretty_oom_instance(incident))
+            assert "Node-local" not in report
+
+    def test_node_local_exhaustion(self, tmpdir):
+        node1 = (
+            "Sep 29 08:12:34 hnsin-varnish kernel: Node 1 Normal free:2097152kB "
+            "boost:0kB min:35588kB low:44484kB high:53380kB active_anon:0kB\n"
+        )
+        lines = read_asset(SINGLE_INCIDENT_LOG).splitlines(True)
+        zone = [i for i, line in enumerate(lines) if "Node 0 Normal free:" in line][0]
+        lines.insert(zone + 1, node1)
+        log_file = tmpdir.join("messages")
+        log_file.write("".join(lines))
+        analyzer = self.get_analyzer(str(log_file))
+        incident = list(analyzer.analyze())[0]
+        assert incident["numa"]["zones"]["Node 1 Normal"] == [
+            2097152,
+            35588,
+            44484,
+            53380,
+        ]
+
+        # Node 0 fell below its low watermark with node 1 free, and only node 0 was allowed
+        exhaustion = analyzer.numa_exhaustion(incident)
+        assert exhaustion["exhausted"] == [0]
+        assert exhaustion["spare"] == [1]
+        assert exhaustion["constrained"]
+        report = "\n".join(analyzer.print_pretty_oom_instance(incident))
+        assert "Node-local exhaustion: node 0 was below its low watermark" in report
+        assert "Constrained OOM: only node(s) 0 were allowed by the cpuset /" in report
+
+        log_file.write(
+            "".join(lines)
+            .replace("CONSTRAINT_NONE", "CONSTRAINT_MEMORY_POLICY")
+            .replace("mems_allowed=0", "mems_allowed=0-1")
+        )
+        analyzer = self.get_analyzer(str(log_file))
+        incident = list(analyzer.analyze())[0]
+        assert analyzer.numa_exhaustion(incident)["constrained"]
+        report = "\n".join(analyzer.print_pretty_oom_instance(incident))
+        assert "allowed by the memory policy" in report
+
+    def test_interleaved_hosts(self, tmpdir):
+        lines = [line + "\n" for line in read_asset(SINGLE_INCIDENT_LOG).splitlines()]
+        other = [
+            line.replace("hnsin-varnish", "hnsin-web").replace("cache-main", "php-fpm")
+            for line in lines
+        ]
+        log_file = tmpdir.join("messages")
+        # A central syslog file, with both hosts' dumps written at the same time
+        log_file.write("".join(line for pair in zip(lines, other) for line in pair))
+        single = list(self.get_analyzer(SINGLE_INCIDENT_LOG).analyze())[0]
+
+        incidents = list(self.get_analyzer(str(log_file)).analyze())
+        assert [incident["host"] for incident in incidents] == [
+            "hnsin-varnish",
+            "hnsin-web",
+        ]
+        assert [incident["killed"] for incident in incidents] == [
+            ["cache-main"],
+            ["php-fpm"],
+        ]
+        for incident in incidents:
+            assert incident["total_mb"] == single["total_mb"]
+            assert len(incident["processes"]) == len(single["processes"])
+
+        incidents = list(
+            self.get_analyzer(str(log_file), only_host="hnsin-web").analyze()
+        )
+        assert [incident["killed"] for incident in incidents] == [["php-fpm"]]
+
+    def dmesg_lines(self, caller, rename=None):
+        """messages.1 as dmesg lines tagged with a printk caller id"""
+        lines = []
+        for line in read_asset(SINGLE_INCIDENT_LOG).splitlines():
+            line = "[  100.000000][ {}] {}\n".format(
+                caller, line.split(" kernel: ", 1)[1]
+            )
+            if rename:
+                line = line.replace("cache-main", rename)
+            lines.append(line.encode("utf-8"))
+        return lines
+
+    def test_concurrent_reports_by_caller_id(self):
+        single = list(self.get_analyzer(SINGLE_INCIDENT_LOG).analyze())[0]
+        first = self.dmesg_lines("T111")
+        second = self.dmesg_lines("T222", rename="php-fpm")
+        # Two tasks printing their reports at the same time
+        lines = [line for pair in zip(first, second) for line in pair]
+
+        incidents = list(self.get_analyzer(SINGLE_INCIDENT_LOG).analyze(lines=lines))
+        assert [incident["killed"] for incident in incidents] == [
+            ["cache-main"],
+            ["php-fpm"],
+        ]
+        for incident in incidents:
+            assert incident["total_mb"] == single["total_mb"]
+            assert len(incident["processes"]) == len(single["processes"])
+
+    def test_quiet_task_report_is_closed(self):
+        # A report that never got as far as its Killed process line
+        lines = [line for line in self.dmesg_lines("T111") if b"Killed" not in line]
+        lines += [
+            b"[  200.000000][   T1] eth0: link up\n"
+        ] * OOMAnalyzer.STALE_CHECK_LINES
+        read = []
+
+        def log():
+            for line in lines:
+                read.append(line)
+                yield line
+
+        incidents = self.get_analyzer(SINGLE_INCIDENT_LOG).analyze(lines=log())
+        incident = next(incidents)
+        assert incident["killed"] == []
+        # Closed once the task went quiet, not at the end of the log
+        assert len(read) < len(lines)
+
+    def test_gentle_reads_the_same_incidents(self, tmpdir):
+        log_file = tmpdir.join("messages.gz")
+        with gzip.open(str(log_file), "wb") as f:
+            f.write(read_asset("tests/assets/logs/messages").encode("utf-8"))
+        expected = list(self.get_analyzer("tests/assets/logs/messages").analyze())
+
+        for path in ("tests/assets/logs/messages", str(log_file)):
+            incidents = list(self.get_analyzer(path, gentle=True).analyze())
+            assert [incident["fingerprint"] for incident in incidents] == [
+                incident["fingerprint"] for incident in expected
+            ]
+
+    def test_gentle_backs_off_under_pressure(self, monkeypatch):
+        sleeps = []
+        monkeypatch.setattr(time, "sleep", sleeps.append)
+        analyzer = self.get_analyzer(SINGLE_INCIDENT_LOG, gentle=True)
+        # 42.5% some avg10, and it never eases off
+        analyzer.pressure = PressureMonitor("tests/assets/proc")
+        assert analyzer.back_off() == OOMAnalyzer.GENTLE_MAX_PAUSE
+        assert len(sleeps) == OOMAnalyzer.GENTLE_MAX_PAUSE // OOMAnalyzer.GENTLE_PAUSE
+
+        analyzer.pressure = PressureMonitor("tests/assets/logs")
+        assert analyzer.back_off() == 0
+
+    def test_cached_summaries(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(OOMAnalyzer, "INDEX_DIR", str(tmpdir.join("cache")))
+        log_file = tmpdir.join("messages")
+        log_file.write(read_asset("tests/assets/logs/messages"))
+        rotated = tmpdir.join("messages.1.gz")
+        with gzip.open(str(rotated), "wb") as f:
+            f.write(read_asset(SINGLE_INCIDENT_LOG).encode("utf-8"))
+        counts = {str(log_file): 19, str(rotated): 1}
+
+        # --quick counts every file and fully analyzes the selected log in the same pass
+        assert self.get_analyzer(str(log_file)).quick_check() == counts
+        analyzer = self.get_analyzer(str(log_file))
+        for path in counts:
+            assert analyzer.load_summary(path)["log"] == path
+        expected = list(self.get_analyzer("tests/assets/logs/messages").analyze())
+
+        def no_reading(*args, **kwargs):
+            raise AssertionError("the log was read again")
+
+        monkeypatch.setattr(OOMAnalyzer, "log_lines", no_reading)
+        assert self.get_analyzer(str(log_file)).quick_check() == counts
+        # A full analysis only reads the incidents back, using the cached offsets
+        analyzer = self.get_analyzer(str(log_file))
+        incidents = list(analyzer.analyze())
+        assert [incident["fingerprint"] for incident in incidents] == [
+            incident["fingerprint"] for incident in expected
+        ]
+        assert incidents[16]["offsets"] == list(analyzer.load_index()[17])
+        assert analyzer.log_start_time == datetime.datetime(1900, 6, 19, 5, 43, 21)
+
+    def test_quick_count_of_an_empty_log(self, tmpdir):
+        log_file = tmpdir.join("messages")
+        log_file.write("")
+
+        assert self.get_analyzer(str(log_file)).quick_check() == {str(log_file): 0}
+        assert list(self.get_analyzer(str(log_file)).analyze()) == []
+
+    def test_cached_summary_of_interleaved_hosts(self, tmpdir):
+        lines = [line + "\n" for line in read_asset(SINGLE_INCIDENT_LOG).splitlines()]
+        # The second host's copy of the same incident is dropped as a duplicate
+        for victim, count in (("php-fpm", 2), ("cache-main", 1)):
+            other = [
+                line.replace("hnsin-varnish", "hnsin-web").replace("cache-main", victim)
+                for line in lines
+            ]
+            log_file = tmpdir.join("messages-" + victim)
+            log_file.write("".join(line for pair in zip(lines, other) for line in pair))
+
+            # The second run reads the hosts' overlapping blocks back from the summary
+            first = list(self.get_analyzer(str(log_file)).analyze())
+            second = list(self.get_analyzer(str(log_file)).analyze())
+            assert len(first) == count
+            assert [incident["fingerprint"] for incident in second] == [
+                incident["fingerprint"] for incident in first
+            ]
+            assert [incident["offsets"] for incident in second] == [
+                incident["offsets"] for incident in first
+            ]
+
+    def test_cached_summary_of_a_recreated_log(self, tmpdir, monkeypatch):
+        log = read_asset(SINGLE_INCIDENT_LOG)
+        log_file = tmpdir.join("messages")
+        log_file.write(
+            log.replace("oom-killer", "oom-k1ller").replace("[  pid  ]", "[  p1d  ]")
+        )
+        assert list(self.get_analyzer(str(log_file)).analyze()) == []
+
+        # Deleted and written again at the same size: the old summary isn't used
+        log_file.remove()
+        log_file.write(log)
+        assert len(list(self.get_analyzer(str(log_file)).analyze())) == 1
+
+        # Nor is a summary whose blocks don't start at an invoking line
+        monkeypatch.setattr(
+            OOMAnalyzer, "summary_path", lambda *args: str(tmpdir.join("x"))
+        )
+        log_file.write(log)
+        assert len(list(self.get_analyzer(str(log_file)).analyze())) == 1
+        log_file.write("\n" * 100 + log)
+        assert len(list(self.get_analyzer(str(log_file)).analyze())) == 1
+
+    def test_recent_incidents_read_backwards(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(OOMAnalyzer, "INDEX_DIR", str(tmpdir))
+        log_file = "tests/assets/logs/messages"
+        # Without a cached summary the total comes from a quick count of process tables
+        recent = self.get_analyzer(log_file).analyze_recent(3)
+        analyzer = self.get_analyzer(log_file)
+        expected = list(analyzer.analyze())[-3:][::-1]
+
+        assert [incident["incident_number"] for incident in recent] == [19, 18, 17]
+        for incident, full in zip(recent, expected):
+            assert incident["fingerprint"] == full["fingerprint"]
+            assert incident["offsets"] == full["offsets"]
+
+        # Enough incidents for the last 2 storms; these are all within a minute of each other
+        analyzer = self.get_analyzer(log_file)
+        recent = analyzer.analyze_recent(2, storm_gap=3600)
+        assert len(recent) == 19
+        assert analyzer.oom_counter == 19
+
+    def test_recent_incidents_start_time(self, tmpdir):
+        log_file = tmpdir.join("messages")
+        log_file.write(
+            "no timestamp\n" * 1200 + read_asset("tests/assets/logs/messages")
+        )
+        analyzer = self.get_analyzer(str(log_file))
+        analyzer.analyze_recent(1)
+        assert analyzer.log_start_time == datetime.datetime(1900, 6, 19, 5, 43, 21)
+
+        # A log with only one of its times known still gets its info printed
+        analyzer.log_start_time = None
+        info = "\n".join(analyzer.print_pretty_log_info())
+        assert "Unable to extract datetime" in info
+        assert "Wed Jun 20 20:32:45" in info
+
+    def test_reversed_lines(self, tmpdir):
+        log_file = tmpdir.join("messages")
+        log_file.write_binary(b"first\nsecond line\n\nlast, no newline")
+        with open(str(log_file), "rb") as f:
+            # Blocks smaller than a line
+            lines = list(iter_reversed_lines(f, size=4))
+        assert lines == [
+            (19, b"last, no newline"),
+            (18, b"\n"),
+            (6, b"second line\n"),
+            (0, b"first\n"),
+        ]
+
+    def test_no_index_for_compressed_logs(self, tmpdir):
+        log_file = tmpdir.join("messages.1.gz")
+        with gzip.open(str(log_file), "wb") as f:
+            f.write(read_asset(SINGLE_INCIDENT_LOG).encode("utf-8"))
+
+        analyzer = self.get_analyzer(str(log_file))
+        assert len(list(analyzer.analyze())) == 1
+        assert analyzer.index_path() is None
+
+
+class TestLeakDetector:
+    def incident(self, hour, processes):
+        return {
+            "start_time": datetime.datetime(1900, 9, 2, hour),
+            "processes": [
+                {"pid": pid, "name": name, "rss": rss}
+                for pid, (name, rss) in enumerate(processes)
+            ],
+        }
+
+    def test_growing_service_is_flagged(self):
+        leaks = LeakDetector(reference_time=datetime.datetime(2024, 12, 31))
+        for hour, java in enumerate([1000, 1210, 1390, 1600]):
+            leaks.add(
+                self.incident(
+                    hour * 2,
+                    # Split across two processes, which are summed by name
+                    [
+                        ("java", java // 2),
+                        ("java", java // 2),
+                        ("nginx", 300 + hour % 2),
+                    ],
+                )
+            )
+
+        found = leaks.leaks()
+        assert [leak["name"] for leak in found] == ["java"]
+        assert 95 < found[0]["mb_per_hour"] < 105
+        assert found[0]["last_rss"] == 1600
+        assert found[0]["last_count"] == 2
+
+    def test_needs_several_incidents(self):
+        leaks = LeakDetector(reference_time=datetime.datetime(2024, 12, 31))
+        leaks.add(self.incident(0, [("java", 1000)]))
+        leaks.add(self.incident(1, [("java", 2000)]))
+        assert leaks.leaks() == []
+
+
+class TestMergeByTime:
+    def test_ordered_across_formats(self):
+        syslog = iter([b"Sep 29 08:12:35 host kernel: b\n", b"  continued\n"])
+        journal = iter(
+            [
+                b"2024-09-29T08:12:34+0000 host kernel: a\n",
+                b"2024-09-29T08:12:36+0000 host kernel: c\n",
+            ]
+        )
+        merged = [raw for _, raw in merge_by_time([syslog, journal])]
+        # The continuation line stays with the line before it
+        assert [line.split()[-1] for line in merged] == [
+            b"a",
+            b"b",
+            b"continued",
+            b"c",
+        ]
+
+    def test_dmesg_placed_using_boot_time(self):
+        booted = datetime.datetime(2024, 9, 29, 8, 0, 0)
+        assert line_time_key(b"[  754.123456] Out of memory", booted) == (
+            9,
+            29,
+            b"08:12:34",
+        )
+        assert line_time_key(b"[  754.123456] Out of memory") is None
+
+
+class TestPressureMonitor:
+    KILL_LINE = (
+        b"Sep 29 08:12:34 hnsin-varnish kernel: Out of memory: Killed process 3117813 "
+        b"(cache-main) total-vm:11705436kB, anon-rss:4805020kB, file-rss:53964kB\n"
+    )
+
+    def monitor(
+        self, cgroup_dir="tests/assets/cgroup", history=PressureMonitor.HISTORY
+    ):
+        return PressureMonitor("tests/assets/proc", cgroup_dir, history=history)
+
+    def test_sample(self):
+        sample = self.monitor().sample()
+        assert sample["some"] == 42.5
+        assert sample["full"] == 30.25
+        assert sample["available_mb"] == 500
+        assert (sample["oom"], sample["oom_kill"], sample["high"], sample["max"]) == (
+            4,
+            3,
+            1250,
+            310,
+        )
+
+    def test_missing_files_are_skipped(self, tmpdir):
+        monitor = PressureMonitor(str(tmpdir), str(tmpdir))
+        assert sorted(monitor.sample()) == ["time"]
+
+    def test_ring_buffer_is_bounded(self):
+        monitor = self.monitor(history=3)
+        for _ in range(10):
+            monitor.sample()
+        assert len(monitor.samples) == 3
+
+    def test_kill_in_log_snapshots_samples(self):
+        monitor = self.monitor()
+        analyzer = OOMAnalyzer(System())
+        start = datetime.datetime(2024, 9, 29, 8, 12)
+        for second in range(3):
+            assert (
+                monitor.poll(analyzer, now=start + datetime.timedelta(seconds=second))
+                == []
+            )
+
+        events = monitor.poll(
+            analyzer,
+            [b"unrelated line\n", self.KILL_LINE],
+            now=start + datetime.timedelta(seconds=3),
+        )
+        assert len(events) == 1
+        assert events[0]["killed"] == ["cache-main"]
+        assert events[0]["oom_kills"] == 0
+        assert len(events[0]["samples"]) == 4
+        lines = monitor.print_pretty_event(events[0])
+        assert any("PSI some avg10" in line for line in lines)
+
+    def test_oom_kill_counter(self, tmpdir):
+        events_file = tmpdir.join("memory.events")
+        events_file.write("oom 0\noom_kill 0\n")
+        monitor = self.monitor(cgroup_dir=str(tmpdir))
+        analyzer = OOMAnalyzer(System())
+        assert monitor.poll(analyzer) == []
+
+        events_file.write("oom 2\noom_kill 2\n")
+        events = monitor.poll(analyzer)
+        assert len(events) == 1
+        assert events[0]["killed"] == []
+        assert events[0]["oom_kills"] == 2
+
+    def test_log_follower(self, tmpdir):
+        log_file = tmpdir.join("messages")
+        log_file.write("before\n")
+        follower = LogFollower(str(log_file))
+        # Only lines written after we start following are returned
+        assert follower.read_new() == []
+
+        with open(str(log_file), "a") as f:
+            f.write("first\nsecond, not fin")
+        assert follower.read_new() == [b"first\n"]
+        with open(str(log_file), "a") as f:
+            f.write("ished\n")
+        assert follower.read_new() == [b"second, not finished\n"]
+
+        # Rotated: the new file is read from its start
+        log_file.rename(tmpdir.join("messages.1"))
+        tmpdir.join("messages").write("after rotation\n")
+        assert follower.read_new() == [b"after rotation\n"]
+        follower.close()
+
+
+class TestServiceGroups:
+    def test_rules(self, tmpdir):
+        rules = tmpdir.join("rules")
+        rules.write(
+            "# kind pattern service\n"
+            "glob    php-fpm*     php  # any pool\n"
+            "\n"
+            "prefix  python       python-workers\n"
+            "regex   java(-\\d+)?  billing-jvm\n"
+            "glob    python3      never-reached\n"
+        )
+        groups = ServiceGroups.from_file(str(rules))
+
+        assert groups.service("php-fpm7.4") == "php"
+        assert groups.service("php-fpm") == "php"
+        assert groups.service("python3") == "python-workers"
+        assert groups.service("java-12") == "billing-jvm"
+        # Regexes and globs match the whole name
+        assert groups.service("javac") == "javac"
+        assert groups.service("xphp-fpm") == "xphp-fpm"
+        assert groups.cache["java-12"] == "billing-jvm"
+
+    def test_many_rules(self):
+        groups = ServiceGroups(
+            [("prefix", "worker{}-".format(i), "pool{}".format(i)) for i in range(250)]
+        )
+        assert len(groups.patterns) == 3
+        assert groups.service("worker0-a") == "pool0"
+        assert groups.service("worker249-a") == "pool249"
+
+    def test_bad_rule(self, tmpdir):
+        rules = tmpdir.join("rules")
+        rules.write("glob php-fpm*\n")
+        with pytest.raises(ValueError) as error:
+            ServiceGroups.from_file(str(rules))
+        assert ":1:" in str(error.value)
+
+
+class TestStormClusterer:
+    def incident(self, number, second, total_mb=100, killed=("php-fpm",)):
+        return {
+            "incident_number": number,
+            "start_time": datetime.datetime(1900, 6, 20, 12, 47, 0)
+            + datetime.timedelta(seconds=second),
+            "total_mb": total_mb,
+            "killed": list(killed),
+        }
+
+    def test_storms(self):
+        storms = StormClusterer(60, reference_time=datetime.datetime(2024, 12, 31))
+        closed = [
+            storms.add(self.incident(1, 0)),
+            storms.add(self.incident(2, 50, total_mb=500, killed=("mysqld",))),
+            # Each incident is within the gap of the previous one
+            storms.add(self.incident(3, 100)),
+            storms.add(self.incident(4, 1000)),
+        ]
+        closed.append(storms.close())
+
+        assert closed[:3] == [None, None, None]
+        assert closed[3]["incidents"] == 3
+        assert closed[3]["peak"]["incident_number"] == 2
+        assert closed[4]["incidents"] == 1
+        assert storms.events == 2
+        # Lone incidents aren't storms
+        assert storms.storms == [
+            {
+                "first_incident": 1,
+                "last_incident": 3,
+                "incidents": 3,
+                "kills": 3,
+                "victims": {"php-fpm": 2, "mysqld": 1},
+                "start": "2024-06-20 12:47:00",
+                "end": "2024-06-20 12:48:40",
+                "duration_seconds": 100,
+                "peak_incident": 2,
+                "peak_total_mb": 500,
+            }
+        ]
+
+    def test_fixture_is_one_storm(self):
+        system = System()
+        system.log_to_use = "tests/assets/logs/messages"
+        storms = StormClusterer(60)
+        for incident in OOMAnalyzer(system).analyze():
+            storms.add(incident)
+        storms.close()
+
+        assert storms.events == 1
+        assert storms.storms[0]["incidents"] == 19
+        assert storms.storms[0]["victims"] == {"php-fpm": 19, "mysqld": 1}
+
+
+class TestTopK:
+    def test_heaviest_names_kept(self):
+        top = TopK(2)
+        for name, value in [("a", 10), ("b", 1), ("c", 5), ("a", 10), ("d", 1)]:
+            top.add(name, value)
+
+        totals = dict((row["name"], row["rss"]) for row in top.as_processes())
+        assert len(totals) == 2
+        assert totals["a"] == 20
+        # Replacement entries inherit the evicted total, so never under-estimate
+        assert totals["d"] >= 1
+
+    def test_many_distinct_names(self):
+        top = TopK(10)
+        for row in range(5000):
+            top.add("heavy", 100)
+            top.add("p{}".format(row), 1)
+
+        totals = dict((row["name"], row["rss"]) for row in top.as_processes())
+        assert len(totals) == 10
+        assert totals["heavy"] == 500000
+        # Stale heap entries are dropped as they build up
+        assert len(top.heap) <= 2 * 10 + 16
+
+
+class TestTimeline:
+    reference_time = datetime.datetime(2024, 12, 31)
+
+    def incident(self, day, hour, killed=("cache-main",), total_mb=100):
+        return {
+            "start_time": datetime.datetime(1900, 9, day, hour, 30),
+            "killed": list(killed),
+            "total_mb": total_mb,
+        }
+
+    def test_buckets(self):
+        timeline = Timeline("day", reference_time=self.reference_time)
+        timeline.add(self.incident(2, 1))
+        timeline.add(self.incident(2, 23, killed=("a", "b")))
+        timeline.add(self.incident(4, 12))
+        timeline.add({"start_time": None, "killed": [], "total_mb": 5})
+
+        buckets = timeline.as_dict()["buckets"]
+        assert buckets[0] == {
+            "start": "2024-09-02 00:00:00",
+            "incidents": 2,
+            "kills": 3,
+            "rss_mb": 200,
+        }
+        assert buckets[1]["start"] == "2024-09-04 00:00:00"
+        assert buckets[2]["start"] == "undated"
+        # The empty day in between shows as a gap
+        assert timeline.sparkline() == "@ +"
+
+    def test_weeks_start_on_monday(self):
+        timeline = Timeline("week", reference_time=self.reference_time)
+        # 2024-09-04 was a Wednesday
+        timeline.add(self.incident(4, 12))
+        assert timeline.as_dict()["buckets"][0]["start"] == "2024-09-02 00:00:00"
+
+    def test_bucket_count_is_bounded(self):
+        timeline = Timeline("hour", reference_time=self.reference_time, max_buckets=3)
+        for hour in range(10):
+            timeline.add(self.incident(2, hour))
+        # A late incident for a folded hour is counted as earlier
+        timeline.add(self.incident(2, 0))
+
+        assert len(timeline.buckets) == 3
+        rows = timeline.rows()
+        assert rows[0][0] == "earlier"
+        assert rows[0][2] == [8, 8, 800]
+        assert sum(counts[0] for _, _, counts in rows) == 11
@@ -7,7 +7,7 @@ import pytest
 oom_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, oom_dir)
 
-from oom_investigate import Printer
+from oom_investigate import Printer, Renderer, System
 
 
 class TestPrinter:
@@ -74,3 +74,45 @@ class TestPrinter:
         self.printer._severity = Printer.INFO
         expected = ["\033[1mTest Header:\033[0m", "line1"]
         assert self.printer.multiline() == expected
+
+    def test_lines_not_shared(self):
+        """Lines collected by one printer must not leak into another."""
+        system = System()
+        system.populate_lines()
+        assert system._lines
+        assert len(Printer()._lines) == 0
+
+    def test_set_colour(self):
+        """Disabling colour removes every ANSI code from the output."""
+        try:
+            Printer.set_colour(False)
+            assert self.printer._critical("Critical message") == "Critical message"
+            assert self.printer.spacer == "_" * 40
+        finally:
+            Printer.set_colour(True)
+        assert self.printer._critical("Critical message") == (
+            "\033[1;31mCritical message\033[0m"
+        )
+
+
+class TestRenderer:
+    def test_write_streams_to_stdout(self, capsys):
+        """Each block is written as soon as it is produced."""
+        renderer = Renderer()
+        renderer.write(["line1", "line2"])
+        out, _ = capsys.readouterr()
+        assert out == "line1\nline2\n"
+
+        renderer.write([])
+        renderer.write(["line3"])
+        renderer.close()
+        out, _ = capsys.readouterr()
+        assert out == "line3\n"
+
+    def test_pager_skipped_when_not_a_tty(self, capsys):
+        """Piped output never starts a pager."""
+        renderer = Renderer(pager="less -R")
+        renderer.write(["line1"])
+        renderer.close()
+        out, _ = capsys.readouterr()
+        assert out == "line1\n"
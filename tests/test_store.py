@@ -0,0 +1,71 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the path so we can import the latest version of the script
+oom_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, oom_dir)
+
+from oom_investigate import IncidentStore, OOMAnalyzer, System
+
+# Ignore DeprecationWarning and PendingDeprecationWarning warnings
+pytest.mark.filterwarnings("ignore::DeprecationWarning")
+pytest.mark.filterwarnings("ignore::PendingDeprecationWarning")
+
+
+class TestIncidentStore:
+    system = System()
+
+    def get_incidents(self, log_file):
+        self.system.log_to_use = log_file
+        return list(OOMAnalyzer(self.system).analyze())
+
+    def test_store_is_idempotent(self, tmpdir):
+        incidents = self.get_incidents("tests/assets/logs/messages.1")
+        db = str(tmpdir.join("incidents.sqlite"))
+
+        store = IncidentStore(db, reference_time=datetime.datetime(2024, 12, 31))
+        assert store.add(incidents[0])
+        assert not store.add(incidents[0])
+        store.close()
+
+        # A second run over the same log adds nothing
+        store = IncidentStore(db, reference_time=datetime.datetime(2024, 12, 31))
+        assert not store.add(incidents[0])
+        headers, rows = store.query("kill-log")
+        store.close()
+
+        assert headers[0] == "TIME"
+        assert rows == [
+            ("2024-09-29 08:12:34", "hnsin-varnish", "cache-main", 3117813, 5249)
+        ]
+
+    def test_reports_filtered_by_date(self, tmpdir):
+        incidents = self.get_incidents("tests/assets/logs/messages.1")
+        store = IncidentStore(
+            str(tmpdir.join("incidents.sqlite")),
+            reference_time=datetime.datetime(2024, 12, 31),
+        )
+        store.add(incidents[0])
+
+        assert store.query("kills")[1][0][:2] == ("cache-main", 1)
+        assert store.query("kills", since="2024-10-01")[1] == []
+        store.close()
+
+    def test_syslog_year_inferred(self, tmpdir):
+        store = IncidentStore(
+            str(tmpdir.join("incidents.sqlite")),
+            reference_time=datetime.datetime(2024, 3, 1),
+        )
+        # Syslog timestamps have no year; dates after the reference are from last year
+        assert (
+            store.normalise_time(datetime.datetime(1900, 2, 1, 10, 0, 0))
+            == "2024-02-01 10:00:00"
+        )
+        assert (
+            store.normalise_time(datetime.datetime(1900, 12, 1, 10, 0, 0))
+            == "2023-12-01 10:00:00"
+        )
+        store.close()